@@ -1,16 +1,17 @@
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 
-from app.db import db_get_user_by_tg, db_set_default_address
+from app.db import db_set_default_address
 from app.states import Addr
 from app.utils import format_address
 
 router = Router()
 
 @router.message(F.text == "Адрес доставки")
-async def address_menu(message: Message, state: FSMContext):
-    user = await db_get_user_by_tg(message.from_user.id)
+async def address_menu(message: Message, state: FSMContext, user: Optional[dict]):
     if not user:
         await message.answer("Сначала зарегистрируйтесь: /start")
         return
@@ -49,7 +50,7 @@ async def addr_floor(message: Message, state: FSMContext):
     await state.set_state(Addr.comment)
 
 @router.message(Addr.comment)
-async def addr_comment(message: Message, state: FSMContext):
+async def addr_comment(message: Message, state: FSMContext, user: Optional[dict]):
     val = (message.text or "").strip()
     data = await state.get_data()
     addr = {
@@ -59,7 +60,6 @@ async def addr_comment(message: Message, state: FSMContext):
         "floor": data.get("floor"),
         "comment": None if val.lower() == "нет" else val if val else None
     }
-    user = await db_get_user_by_tg(message.from_user.id)
     await db_set_default_address(user["id"], addr)
     await state.clear()
     await message.answer("Адрес сохранён как адрес по умолчанию:\n" + format_address(addr))
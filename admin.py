@@ -1,20 +1,28 @@
 from aiogram import Router, F
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
+from typing import Optional
+import httpx
+from datetime import datetime, timedelta
 
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from app.config import ADMIN_TG_IDS
+from app.config import ADMIN_TG_IDS, DEFAULT_CATALOG_URL, REPORT_UTC_OFFSET_HOURS
 from app.db import (
-    db_get_user_active_orders, db_set_order_status, db_get_setting, db_set_setting,
+    db_list_orders_board, db_count_orders_by_status, db_set_orders_status,
+    db_get_courier_fee_minor, db_get_setting, db_set_setting,
     db_list_products_admin, db_create_product, db_set_product_available, db_update_product_price,
     db_get_product, db_update_product_title, db_delete_product, db_update_product_photo,
-    db_get_or_create_general_category_id
+    db_get_or_create_general_category_id, db_sales_report, db_rebuild_sales_aggregates
 )
-from app.keyboards import admin_kb, admin_products_kb, admin_product_actions_kb
-from app.utils import format_address, make_unique_sku
-import json
+from app import metrics
+from app.catalog import import_catalog, CatalogFormatError
+from app.notifications import notify_status_changed, get_notifier
+from app.update_scheduler import UpdateScheduler
+from app.keyboards import admin_kb, admin_products_kb, admin_product_actions_kb, admin_orders_kb
+from app.utils import make_unique_sku
 import re
 
 router = Router()
@@ -107,7 +115,7 @@ async def adm_list_products(cb: CallbackQuery):
     if cb.from_user.id not in ADMIN_TG_IDS:
         await cb.answer("Нет доступа", show_alert=True); return
     prods = await db_list_products_admin(limit=50)
-    await cb.message.edit_text("Товары (последние 50):", reply_markup=admin_products_kb(prods))
+    await cb.message.edit_text("Товары (последние 50):", reply_markup=admin_products_kb(prods, cache_key=50))
 
 @router.callback_query(F.data.regexp(r"^adm:prod:\d+$"))
 async def adm_product_actions(cb: CallbackQuery):
@@ -222,25 +230,68 @@ async def adm_product_delete(cb: CallbackQuery):
     prod_id = int(cb.data.split(":")[3])
     await db_delete_product(prod_id)
     prods = await db_list_products_admin(limit=50)
-    await cb.message.edit_text("Товар удалён. Список:", reply_markup=admin_products_kb(prods))
+    await cb.message.edit_text("Товар удалён. Список:", reply_markup=admin_products_kb(prods, cache_key=50))
 
 # ------- Заказы и тариф -------
+ORDERS_PAGE_SIZE = 10
+
+async def _show_orders_board(cb: CallbackQuery, current: str, cursor=None):
+    status = None if current == "all" else current
+    orders, has_prev, has_next = await db_list_orders_board(status, ORDERS_PAGE_SIZE, cursor)
+    counts = await db_count_orders_by_status()
+    counts["all"] = sum(counts.values())
+    total = counts.get(current)
+    header = f"Заказы: {current}" + (f" — {total}" if total is not None else "")
+    lines = [
+        f"#{o['id']} | {o['status']} | {o['total_minor']/100:.2f} ₽ | {o['name']} {o['phone']} | "
+        f"{(o['address_text'] or 'Самовывоз')[:200]}"
+        for o in orders
+    ] or ["Заказов нет."]
+    text = header + "\n" + "\n".join(lines) + "\n\nСменить статус: /set <id> <status> (или 12,15 / 10-20)"
+    kb = admin_orders_kb(
+        current, counts,
+        orders[0]["id"] if orders else None, orders[-1]["id"] if orders else None,
+        has_prev, has_next
+    )
+    try:
+        await cb.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        # «message is not modified» при повторном нажатии той же вкладки
+        pass
+    await cb.answer()
+
 @router.callback_query(F.data == "adm:orders")
 async def adm_orders(cb: CallbackQuery):
     if cb.from_user.id not in ADMIN_TG_IDS:
         await cb.answer("Нет доступа", show_alert=True); return
-    from app.db import db_get_user_active_orders
-    orders = await db_get_user_active_orders()
-    if not orders:
-        await cb.message.edit_text("Активных заказов нет.", reply_markup=admin_kb())
-        return
-    lines = []
-    for o in orders:
-        addr = json.loads(o.get("address_snapshot") or "{}")
-        addr_txt = format_address(addr) if addr else "Самовывоз"
-        lines.append(f"#{o['id']} | {o['status']} | {o['total_minor']/100:.2f} ₽ | {o['name']} {o['phone']} | {addr_txt}")
-    text = "Заказы:\n" + "\n".join(lines)[:3500] + "\n\nСменить статус: /set <id> <status>"
-    await cb.message.edit_text(text, reply_markup=admin_kb())
+    await _show_orders_board(cb, "all")
+
+@router.callback_query(F.data.startswith("adm:ord:"))
+async def adm_orders_page(cb: CallbackQuery):
+    if cb.from_user.id not in ADMIN_TG_IDS:
+        await cb.answer("Нет доступа", show_alert=True); return
+    parts = cb.data.split(":")
+    if len(parts) != 5 or parts[2] not in ("all",) + ORDER_STATUSES or parts[3] not in ("n", "p") or not parts[4].isdigit():
+        await cb.answer(); return
+    oid = int(parts[4])
+    await _show_orders_board(cb, parts[2], (parts[3], oid) if oid else None)
+
+ORDER_STATUSES = ("confirming", "preparing", "delivering", "delivered", "canceled")
+BULK_SET_MAX = 1000
+
+def _parse_order_ids(spec: str) -> Optional[list]:
+    """'12' / '12,15,18' / '10-20' / '10-20,25' -> список id; None — ошибка формата или слишком много."""
+    ids = []
+    for part in spec.split(","):
+        m = re.fullmatch(r"(\d+)(?:-(\d+))?", part.strip())
+        if not m:
+            return None
+        lo = int(m.group(1))
+        hi = int(m.group(2)) if m.group(2) else lo
+        if hi < lo or len(ids) + (hi - lo + 1) > BULK_SET_MAX:
+            return None
+        ids.extend(range(lo, hi + 1))
+    return ids
 
 @router.message(Command("set"))
 async def admin_set_status(message: Message):
@@ -248,25 +299,38 @@ async def admin_set_status(message: Message):
         await message.answer("Нет доступа."); return
     parts = (message.text or "").split()
     if len(parts) != 3:
-        await message.answer("Использование: /set <order_id> <status>\nСтатусы: confirming, preparing, delivering, delivered, canceled")
+        await message.answer(
+            "Использование: /set <order_id> <status>\n"
+            "Несколько заказов: /set 12,15,18 <status> или /set 10-20 <status>\n"
+            "Статусы: confirming, preparing, delivering, delivered, canceled"
+        )
         return
-    try:
-        oid = int(parts[1])
-    except:
-        await message.answer("order_id должен быть числом.")
+    ids = _parse_order_ids(parts[1])
+    if not ids:
+        await message.answer(f"Укажите номера заказов числами, через запятую или диапазоном (не больше {BULK_SET_MAX}).")
         return
     status = parts[2]
-    if status not in ("confirming","preparing","delivering","delivered","canceled"):
+    if status not in ORDER_STATUSES:
         await message.answer("Неверный статус.")
         return
-    await db_set_order_status(oid, status)
-    await message.answer(f"Статус заказа #{oid} изменён на {status}.")
+    # одна транзакция на все заказы; уведомления покупателям уходят в фоне
+    changed = await db_set_orders_status(ids, status)
+    queued = notify_status_changed(message.bot, changed, status)
+    if len(ids) == 1:
+        if changed:
+            await message.answer(f"Статус заказа #{ids[0]} изменён на {status}.")
+        else:
+            await message.answer(f"Заказ #{ids[0]} не найден или уже в статусе {status}.")
+        return
+    await message.answer(
+        f"Статус {status}: изменено заказов {len(changed)} из {len(ids)}, уведомлений в очереди {queued}."
+    )
 
 @router.callback_query(F.data == "adm:tariff")
 async def adm_tariff(cb: CallbackQuery):
     if cb.from_user.id not in ADMIN_TG_IDS:
         await cb.answer("Нет доступа", show_alert=True); return
-    fee_minor = int(await db_get_setting("courier_fee_minor", "15000"))
+    fee_minor = await db_get_courier_fee_minor()
     fee_rub = fee_minor // 100
     await cb.message.edit_text(f"Текущий тариф курьера: {fee_rub} ₽.\nОтправьте команду: /tariff <руб>")
 
@@ -285,3 +349,140 @@ async def adm_tariff_set(message: Message):
     fee_minor = int(digits) * 100
     await db_set_setting("courier_fee_minor", str(fee_minor))
     await message.answer(f"Тариф обновлён: {int(digits)} ₽")
+
+# ------- Каталог поставщика -------
+@router.message(Command("seturl"))
+async def admin_set_catalog_url(message: Message):
+    if message.from_user.id not in ADMIN_TG_IDS:
+        await message.answer("Нет доступа."); return
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2:
+        url = await db_get_setting("catalog_url", DEFAULT_CATALOG_URL)
+        await message.answer(
+            f"Каталог: {url or 'локальный catalog.json'}\n"
+            "Использование: /seturl <URL> (или /seturl - — локальный файл), затем /refresh"
+        )
+        return
+    url = parts[1].strip()
+    if url == "-":
+        url = ""
+    elif not re.match(r"^https?://", url):
+        await message.answer("Нужен адрес вида https://...")
+        return
+    await db_set_setting("catalog_url", url)
+    await message.answer(f"Источник каталога: {url or 'локальный catalog.json'}. Загрузить: /refresh")
+
+@router.message(Command("refresh"))
+async def admin_refresh_catalog(message: Message):
+    if message.from_user.id not in ADMIN_TG_IDS:
+        await message.answer("Нет доступа."); return
+    await message.answer("Загружаю каталог…")
+    try:
+        r = await import_catalog()
+    except (httpx.HTTPError, OSError, CatalogFormatError) as e:
+        await message.answer(f"Каталог не загружен: {e}")
+        return
+    await message.answer(
+        f"Каталог обновлён за {r['seconds']:.1f} с:\n"
+        f"— добавлено: {r['added']}\n"
+        f"— изменено: {r['updated']}\n"
+        f"— скрыто (нет в выгрузке): {r['deactivated']}\n"
+        f"— без изменений: {r['unchanged']}"
+        + (f"\n— пропущено некорректных позиций: {r['skipped']}" if r["skipped"] else "")
+    )
+
+# ------- Статистика производительности -------
+STATS_TOP = 10
+
+def _fmt_top(rows: list, label) -> list:
+    # самые «дорогие» по суммарному времени — именно они и есть горячие пути
+    rows = sorted(rows, key=lambda r: r["sum"], reverse=True)[:STATS_TOP]
+    return [
+        f"{label(r['labels'])}: n={r['count']} avg={r['avg'] * 1000:.1f}мс "
+        f"p95≤{r['p95'] * 1000:g}мс всего={r['sum']:.1f}с"
+        for r in rows
+    ]
+
+@router.message(Command("stats"))
+async def admin_stats(message: Message, update_scheduler: Optional[UpdateScheduler] = None):
+    if message.from_user.id not in ADMIN_TG_IDS:
+        await message.answer("Нет доступа."); return
+    parts = (message.text or "").split()
+    if len(parts) == 2 and parts[1] == "reset":
+        metrics.reset()
+        await message.answer("Статистика сброшена.")
+        return
+    lines = ["Хендлеры:"]
+    lines += _fmt_top(
+        metrics.HANDLER_SECONDS.summary(),
+        lambda l: f"{l['router']}.{l['handler']}" + (f" [{l['prefix']}]" if l["prefix"] else "")
+    ) or ["нет данных"]
+    lines += ["", "SQL:"]
+    lines += _fmt_top(metrics.DB_QUERY_SECONDS.summary(), lambda l: l["query"]) or ["нет данных"]
+    errors = sum(metrics.HANDLER_ERRORS.series.values())
+    if errors:
+        lines += ["", f"Ошибок в хендлерах: {int(errors)}"]
+    if update_scheduler is not None:
+        st = update_scheduler.stats()
+        lines += ["", (
+            f"Очередь апдейтов: в работе {st['busy']}/{st['workers']}, ждут {st['queued']} "
+            f"(макс. у одного пользователя {st['max_queue_depth']}), обработано {st['processed']}, ошибок {st['failed']}"
+        )]
+    nt = get_notifier().stats()
+    lines += ["", (
+        f"Уведомления: в очереди {nt['queued']}, отправлено {nt['sent']}, "
+        f"ошибок {nt['failed']}, отброшено {nt['dropped']}"
+    )]
+    await message.answer("\n".join(lines)[:4000])
+
+# ------- Отчёт о продажах -------
+REPORT_TOP_SKUS = 10
+
+def _parse_day(text: str) -> Optional[str]:
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+@router.message(Command("report"))
+async def admin_report(message: Message):
+    if message.from_user.id not in ADMIN_TG_IDS:
+        await message.answer("Нет доступа."); return
+    parts = (message.text or "").split()[1:]
+    if parts == ["rebuild"]:
+        await db_rebuild_sales_aggregates()
+        await message.answer("Агрегаты продаж пересчитаны.")
+        return
+    today = (datetime.utcnow() + timedelta(hours=REPORT_UTC_OFFSET_HOURS)).strftime("%Y-%m-%d")
+    days = [_parse_day(p) for p in parts[:2]] or [today]
+    if len(parts) > 2 or None in days:
+        await message.answer("Использование: /report [с YYYY-MM-DD] [по YYYY-MM-DD], например /report 2024-05-01 2024-05-31")
+        return
+    day_from, day_to = days[0], days[-1]
+    if day_from > day_to:
+        day_from, day_to = day_to, day_from
+
+    r = await db_sales_report(day_from, day_to, REPORT_TOP_SKUS)
+    period = day_from if day_from == day_to else f"{day_from} — {day_to}"
+    n = r["delivered_orders"]
+    lines = [
+        f"Продажи за {period}:",
+        f"Доставлено заказов: {n}, выручка {r['revenue_minor']/100:.2f} ₽"
+        + (f", средний чек {r['revenue_minor']/n/100:.2f} ₽" if n else ""),
+        f"Самовывоз: {r['pickup_orders']}, курьер: {r['courier_orders']} "
+        f"(доставка {r['delivery_fee_minor']/100:.2f} ₽)",
+        f"Отменено: {r['canceled_orders']}",
+    ]
+    if r["peak_hour"]:
+        h = r["peak_hour"]
+        lines.append(
+            f"Пиковый час: {h['hour'].replace('T', ' ')}:00 — {h['delivered_orders']} зак., "
+            f"{h['revenue_minor']/100:.2f} ₽"
+        )
+    if r["top_skus"]:
+        lines += ["", "Топ товаров:"]
+        lines += [
+            f"{i}. {s['title']} ({s['sku']}): {s['units']} шт., {s['revenue_minor']/100:.2f} ₽"
+            for i, s in enumerate(r["top_skus"], 1)
+        ]
+    await message.answer("\n".join(lines)[:4000])
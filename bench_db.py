@@ -0,0 +1,258 @@
+"""
+Микробенчмарки слоя db.py на синтетических данных.
+
+Генерирует БД заданного размера (товары, пользователи, заказы и позиции),
+затем замеряет отдельные функции db.py и печатает таблицу результатов.
+Результаты можно сохранить в JSON и сравнить со следующим прогоном.
+
+Запуск:
+    python -m app.bench_db --products 50000 --users 200000 --orders 2000000
+    python -m app.bench_db --db /tmp/big.db --reuse --save after.json --compare before.json
+
+Путь к БД задаётся --db (DB_PATH из .env не используется); по умолчанию — временный файл.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ACTIVE_STATUSES = ("confirming", "preparing", "delivering")
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарки функций db.py")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов на каждый замер")
+    parser.add_argument("--db", default="", help="файл БД (по умолчанию временный)")
+    parser.add_argument("--reuse", action="store_true", help="не генерировать данные, если файл БД уже есть")
+    parser.add_argument("--save", default="", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", default="", help="сравнить с ранее сохранённым JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+ARGS = _parse_args() if __name__ == "__main__" else None
+if ARGS is not None:
+    os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+
+from app import db as app_db  # noqa: E402  (BOT_TOKEN должен быть задан до импорта)
+
+if ARGS is not None:
+    # пакет app мог импортировать db.py раньше нас, с DB_PATH рабочей базы —
+    # подменяем путь в самом модуле, до первого соединения
+    app_db.DB_PATH = ARGS.db or os.path.join(tempfile.mkdtemp(prefix="bench_db_"), "bench.db")
+
+
+# ---------------------- DATA GENERATOR ----------------------
+def _chunks(rows, size: int = 50000):
+    buf = []
+    for r in rows:
+        buf.append(r)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def generate(path: str, products: int, users: int, orders: int, items_per_order: int, seed: int = 1):
+    """
+    Заполняет уже созданную схему синтетическими данными (sqlite3 напрямую, executemany пачками).
+    У каждого заказа items_per_order позиций с разными SKU; ~10% заказов активны.
+    """
+    rnd = random.Random(seed)
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("INSERT OR IGNORE INTO categories(slug, title) VALUES('bench', 'Бенчмарк')")
+    cat_id = con.execute("SELECT id FROM categories WHERE slug = 'bench'").fetchone()[0]
+    words = ["пирожок", "булочка", "хлеб", "торт", "пирог", "харчо", "суп", "круассан", "ватрушка", "эклер"]
+
+    con.executemany(
+        "INSERT INTO products(category_id, sku, title, price_minor, available, sort_order) VALUES(?,?,?,?,?,?)",
+        ((cat_id, f"sku-{i}", f"{rnd.choice(words).capitalize()} {rnd.choice(words)} {i}",
+          rnd.randint(50, 2000) * 100, 1 if rnd.random() < 0.9 else 0, rnd.randint(0, 9))
+         for i in range(products))
+    )
+    for chunk in _chunks((1_000_000 + i, f"User {i}", f"+7900{i:07d}", 1) for i in range(users)):
+        con.executemany("INSERT INTO users(tg_id, name, phone, is_verified) VALUES(?,?,?,?)", chunk)
+    user_ids = [r[0] for r in con.execute("SELECT id FROM users WHERE tg_id >= 1000000")]
+    prices = dict(con.execute("SELECT sku, price_minor FROM products"))
+
+    start = datetime.utcnow() - timedelta(days=365)
+    first_order = (con.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]) + 1
+
+    def order_rows():
+        for n in range(orders):
+            r = rnd.random()
+            status = "delivered" if r < 0.8 else "canceled" if r < 0.9 else rnd.choice(ACTIVE_STATUSES)
+            kind = "courier" if rnd.random() < 0.5 else "pickup"
+            fee = 15000 if kind == "courier" else 0
+            created = (start + timedelta(seconds=n * 31_536_000 // max(1, orders))).isoformat()
+            yield (first_order + n, rnd.choice(user_ids), status, kind, fee, created)
+
+    for chunk in _chunks(order_rows()):
+        con.executemany(
+            "INSERT INTO orders(id, user_id, status, delivery_type, delivery_fee_minor, created_at) VALUES(?,?,?,?,?,?)",
+            chunk
+        )
+
+    def item_rows():
+        k = max(1, min(items_per_order, products))
+        for n in range(orders):
+            oid = first_order + n
+            for j in range(k):
+                sku = f"sku-{(n * 7 + j * 13) % products}"
+                yield (oid, sku, sku, prices[sku], rnd.randint(1, 3))
+
+    if products:
+        for chunk in _chunks(item_rows()):
+            con.executemany(
+                "INSERT OR IGNORE INTO order_items(order_id, sku, title, unit_price_minor, qty) VALUES(?,?,?,?,?)",
+                chunk
+            )
+    con.execute("""
+        UPDATE orders
+           SET subtotal_minor = (SELECT COALESCE(SUM(unit_price_minor * qty), 0) FROM order_items WHERE order_id = orders.id)
+         WHERE id >= ?
+    """, (first_order,))
+    con.execute("UPDATE orders SET total_minor = subtotal_minor + delivery_fee_minor WHERE id >= ?", (first_order,))
+    con.commit()
+    con.execute("ANALYZE")
+    con.close()
+
+
+# ---------------------- BENCHMARKS ----------------------
+async def _measure(fn: Callable[[int], Awaitable[Any]], iterations: int) -> Dict[str, float]:
+    timings: List[float] = []
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        await fn(i)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    total = sum(timings)
+    return {
+        "mean_ms": total / len(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "ops_s": len(timings) / total if total else 0.0,
+    }
+
+
+async def run_benchmarks(iterations: int, seed: int = 1) -> Dict[str, Dict[str, float]]:
+    rnd = random.Random(seed)
+    results: Dict[str, Dict[str, float]] = {}
+
+    # последняя страница публичного списка — курсор «после предпоследнего товара»
+    _, total, _, _ = await app_db.db_list_products_public(page_size=10)
+    cache = await app_db._catalog_ensure()
+    deep = cache.public[-11] if len(cache.public) > 11 else None
+    deep_cursor = ("n", deep["sort_order"], deep["id"]) if deep else None
+
+    async def list_cold(_):
+        app_db._catalog_invalidate()
+        await app_db.db_list_products_public(page_size=10)
+
+    async def list_first(_):
+        await app_db.db_list_products_public(page_size=10)
+
+    async def list_deep(_):
+        await app_db.db_list_products_public(page_size=10, cursor=deep_cursor)
+
+    async def list_deep_sql(_):
+        await app_db._db_list_products_keyset(deep_cursor, 10, None)
+
+    queries = ["пир", "булочка", "хлеб 12", "торт", "sku-1", "харчо суп"]
+
+    async def search(i):
+        await app_db.db_search_products_public(queries[i % len(queries)], page=1, page_size=10)
+
+    async def active_orders(_):
+        await app_db.db_get_user_active_orders(limit=20)
+
+    async with app_db._read() as db:
+        cur = await db.execute("SELECT id FROM users ORDER BY id LIMIT 1000")
+        user_ids = [r[0] for r in await cur.fetchall()]
+    skus = [p for p in cache.public[:500]]
+    carts: Dict[int, int] = {}
+
+    async def cart_for(i: int) -> int:
+        uid = user_ids[i % len(user_ids)]
+        if uid not in carts:
+            carts[uid] = await app_db.db_get_or_create_cart(uid)
+        return carts[uid]
+
+    async def add_item(i):
+        p = rnd.choice(skus)
+        await app_db.db_add_item_to_cart(await cart_for(i), p["sku"], p["title"], p["price_minor"])
+
+    async def set_delivery_fee(i):
+        await app_db.db_set_order_delivery_fee(await cart_for(i), 15000 if i % 2 else 0)
+
+    cases = [
+        ("list_products_public:cold", list_cold, max(5, iterations // 20)),
+        ("list_products_public:first", list_first, iterations),
+        ("list_products_public:deep", list_deep, iterations),
+        ("list_products_keyset_sql:deep", list_deep_sql, iterations),
+        ("search_products_public", search, iterations),
+        ("get_user_active_orders", active_orders, iterations),
+    ]
+    if user_ids and skus:
+        cases += [
+            ("add_item_to_cart", add_item, iterations),
+            ("set_order_delivery_fee", set_delivery_fee, iterations),
+        ]
+    for name, fn, n in cases:
+        results[name] = await _measure(fn, n)
+    results["_meta"] = {"public_products": float(total)}
+    return results
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]] = None):
+    print(f"{'benchmark':<32} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>10}" + ("  vs base" if baseline else ""))
+    for name, r in results.items():
+        if name.startswith("_"):
+            continue
+        line = f"{name:<32} {r['mean_ms']:>9.3f} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['ops_s']:>10.1f}"
+        if baseline and name in baseline and baseline[name]["mean_ms"]:
+            delta = (r["mean_ms"] / baseline[name]["mean_ms"] - 1) * 100
+            line += f"  {delta:+7.1f}%"
+        print(line)
+
+
+async def main(args: argparse.Namespace):
+    path = app_db.DB_PATH
+    fresh = not (args.reuse and os.path.exists(path))
+    try:
+        await app_db.init_db()
+        if fresh:
+            t0 = time.perf_counter()
+            generate(path, args.products, args.users, args.orders, args.items_per_order, args.seed)
+            print(f"generated in {time.perf_counter() - t0:.1f}s: {path}", file=sys.stderr)
+        results = await run_benchmarks(args.iterations, args.seed)
+    finally:
+        await app_db.close_db()
+    results["_meta"].update({
+        "products": float(args.products), "users": float(args.users), "orders": float(args.orders),
+    })
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(ARGS))
@@ -0,0 +1,283 @@
+"""
+Нагрузочный тест бота целиком: тот же Dispatcher и роутеры, что в main.py,
+Bot с локальной фейковой сессией (исходящие вызовы API только записываются),
+временная БД (DB_PATH). Как в main.py, апдейты идут через UpdateScheduler,
+а исходящие вызовы — через SendScheduler с лимитами из конфигурации
+(SEND_GLOBAL_RATE, SEND_CHAT_RATE, ...; для замера без лимитов Telegram
+их можно поднять переменными окружения). Каждый виртуальный пользователь
+проходит сценарий
+/start → регистрация → Каталог → view: → add: → Корзина → checkout → deliv: → confirm:.
+
+Запуск:
+    python -m app.bench_load --users 2000 --concurrency 200 --products 300
+
+В конце печатается пропускная способность и p50/p95/p99 по каждому шагу (хендлеру).
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    EditMessageCaption, EditMessageReplyMarkup, EditMessageText, GetMe,
+    SendMessage, SendPhoto, TelegramMethod
+)
+from aiogram.types import Chat, InlineKeyboardMarkup, Message, Update, User
+
+from app import db as app_db, sms as app_sms
+from app.config import (
+    UPDATE_WORKERS, UPDATE_QUEUE_SIZE,
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_INTERACTIVE_RESERVE
+)
+from app.main import build_dispatcher
+from app.send_scheduler import SendScheduler
+from app.sms import close_sms
+from app.update_scheduler import UpdateScheduler
+
+# app/__init__ уже импортировал config, db и sms, так что переменные окружения
+# здесь опоздали бы: подменяем значения прямо в модулях (как check_query_plans.py)
+app_db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="bench_load_"), "bench.db")
+app_sms.SMS_PROVIDER = "mock"  # никаких настоящих SMS, даже если в .env указан шлюз
+app_sms.SMS_RATE_PER_SECOND = 0
+
+OTP_CODE = "1234"
+# методы, которые возвращают Message
+MESSAGE_METHODS = (SendMessage, SendPhoto, EditMessageText, EditMessageCaption, EditMessageReplyMarkup)
+
+
+class FakeSession(BaseSession):
+    """Сессия без сети: запоминает исходящие вызовы и последнюю inline-клавиатуру по чату."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Dict[str, int] = {}
+        self.last_markup: Dict[int, InlineKeyboardMarkup] = {}
+        self._message_id = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        chat_id = getattr(method, "chat_id", None)
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(chat_id, int) and isinstance(markup, InlineKeyboardMarkup):
+            self.last_markup[chat_id] = markup
+        if isinstance(method, GetMe):
+            return User(id=42, is_bot=True, first_name="bench")
+        if isinstance(method, MESSAGE_METHODS):
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=chat_id or 0, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(
+        self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+        chunk_size: int = 65536, raise_for_status: bool = True
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class Journey:
+    """Сценарий одного пользователя; каждый шаг — один апдейт через dp.feed_raw_update."""
+
+    def __init__(self, bench: "LoadBench", tg_id: int):
+        self.bench = bench
+        self.tg_id = tg_id
+        self.user = {"id": tg_id, "is_bot": False, "first_name": f"U{tg_id}"}
+        self.chat = {"id": tg_id, "type": "private"}
+
+    def _message(self, text: str) -> Dict[str, Any]:
+        return {
+            "update_id": self.bench.next_update_id(),
+            "message": {
+                "message_id": self.bench.next_update_id(),
+                "date": int(time.time()),
+                "chat": self.chat,
+                "from": self.user,
+                "text": text,
+            },
+        }
+
+    def _callback(self, data: str) -> Dict[str, Any]:
+        uid = self.bench.next_update_id()
+        return {
+            "update_id": uid,
+            "callback_query": {
+                "id": str(uid),
+                "from": self.user,
+                "chat_instance": str(self.tg_id),
+                "data": data,
+                "message": {
+                    "message_id": uid,
+                    "date": int(time.time()),
+                    "chat": self.chat,
+                    "text": "…",
+                },
+            },
+        }
+
+    def _button(self, prefix: str) -> Optional[str]:
+        markup = self.bench.session.last_markup.get(self.tg_id)
+        if not markup:
+            return None
+        for row in markup.inline_keyboard:
+            for btn in row:
+                if btn.callback_data and btn.callback_data.startswith(prefix):
+                    return btn.callback_data
+        return None
+
+    async def run(self):
+        steps = [
+            ("start", lambda: self._message("/start")),
+            ("reg_name", lambda: self._message(f"Пользователь {self.tg_id}")),
+            ("reg_phone", lambda: self._message(f"+7900{self.tg_id:07d}")),
+            ("reg_otp", lambda: self._message(OTP_CODE)),
+            ("catalog", lambda: self._message("Каталог")),
+            ("view", lambda: self._callback(self._button("view:") or "view:1")),
+            ("add", lambda: self._callback(self._button("add:") or "add:1")),
+            ("cart", lambda: self._message("Корзина")),
+            ("checkout", lambda: self._callback("checkout")),
+            ("deliv", lambda: self._callback("deliv:pickup")),
+            ("confirm", lambda: self._callback("confirm:pickup")),
+        ]
+        for name, make in steps:
+            await self.bench.feed(name, make())
+
+
+class LoadBench:
+    def __init__(self, users: int, concurrency: int, products: int):
+        self.users = users
+        self.concurrency = concurrency
+        self.products = products
+        self.session = FakeSession()
+        self.session.middleware(SendScheduler(
+            global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+            chat_burst=SEND_CHAT_BURST, reserve=SEND_INTERACTIVE_RESERVE,
+        ))
+        self.bot = Bot("42:BENCH", session=self.session)
+        self.scheduler = UpdateScheduler(workers=UPDATE_WORKERS, queue_size=UPDATE_QUEUE_SIZE)
+        self.dp = build_dispatcher(self.scheduler)
+        # планировщик только ставит апдейт в очередь; конец обработки ловим внутри воркера
+        self.dp.update.middleware(self._track)
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._update_id = 0
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    async def _track(self, handler, event: Update, data: Dict[str, Any]) -> Any:
+        fut = self._pending.pop(event.update_id, None)
+        try:
+            result = await handler(event, data)
+        except Exception as e:
+            if fut is not None and not fut.done():
+                fut.set_exception(e)
+            raise
+        if fut is not None and not fut.done():
+            fut.set_result(result)
+        return result
+
+    async def feed(self, step: str, update: Dict[str, Any]):
+        # шаг считается от постановки в очередь до конца обработки хендлером
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[update["update_id"]] = fut
+        t0 = time.perf_counter()
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+            await fut
+        except Exception:
+            self.errors[step] = self.errors.get(step, 0) + 1
+        finally:
+            self._pending.pop(update["update_id"], None)
+        self.latencies.setdefault(step, []).append(time.perf_counter() - t0)
+
+    async def seed(self):
+        cat_id = await app_db.db_create_category("Бенчмарк", "bench")
+        for i in range(self.products):
+            await app_db.db_create_product(
+                cat_id=cat_id, title=f"Товар {i}", price_minor=1000 + i * 10,
+                sku=f"bench-{i}", sort_order=i % 5
+            )
+
+    async def run(self) -> float:
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def one(tg_id: int):
+            async with sem:
+                await Journey(self, tg_id).run()
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(100000 + i) for i in range(self.users)))
+        return time.perf_counter() - t0
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def print_report(bench: LoadBench, elapsed: float):
+    total = sum(len(v) for v in bench.latencies.values())
+    print(f"users={bench.users} concurrency={bench.concurrency} products={bench.products}")
+    print(f"updates={total} time={elapsed:.2f}s throughput={total / elapsed:.1f} upd/s")
+    print(f"{'step':<10} {'count':>7} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for step, values in bench.latencies.items():
+        print(
+            f"{step:<10} {len(values):>7} {bench.errors.get(step, 0):>6} "
+            f"{_percentile(values, 0.50) * 1000:>8.2f} {_percentile(values, 0.95) * 1000:>8.2f} "
+            f"{_percentile(values, 0.99) * 1000:>8.2f}"
+        )
+    print("API calls: " + ", ".join(f"{k}={v}" for k, v in sorted(bench.session.calls.items())))
+    print("scheduler: " + ", ".join(f"{k}={v}" for k, v in bench.scheduler.stats().items()))
+
+
+def _patch_registration():
+    # SMS уходят в заглушку mock, код подтверждения фиксированный
+    from app import start_registration
+
+    start_registration.make_otp_code = lambda *a, **k: OTP_CODE
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Dispatcher на синтетических апдейтах")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--products", type=int, default=200)
+    args = parser.parse_args()
+
+    _patch_registration()
+    await app_db.init_db()
+    bench = LoadBench(args.users, args.concurrency, args.products)
+    try:
+        await bench.seed()
+        elapsed = await bench.run()
+        print_report(bench, elapsed)
+    finally:
+        await bench.scheduler.close()
+        await bench.bot.session.close()
+        await bench.dp.storage.close()
+        await close_sms()
+        await app_db.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,9 +1,12 @@
 import json
-from typing import Dict, Any
+import time
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 import httpx
 
 from app.config import DEFAULT_CATALOG_URL
-from app.db import db_get_setting
+from app.db import db_get_setting, db_import_products
+
+CHUNK_SIZE = 64 * 1024
 
 CATALOG: Dict[str, Any] = {}
 SKU_INDEX: Dict[str, Dict[str, Any]] = {}
@@ -46,3 +49,198 @@ async def load_catalog() -> bool:
             }
     print(f"[CATALOG] SKU: {len(SKU_INDEX)}; Categories: {len(CATALOG.get('categories', []))}")
     return True
+
+
+# ---------------------- ПОТОКОВЫЙ ИМПОРТ ----------------------
+class CatalogFormatError(ValueError):
+    pass
+
+
+class _JsonStream:
+    """
+    Инкрементальное чтение JSON из потока кусков текста: структура
+    {"categories": [{..., "items": [{...}, ...]}, ...]} обходится по токенам,
+    а целиком декодируются только мелкие значения (поля категории, товары).
+    Весь документ в памяти не держится.
+    """
+
+    def __init__(self, chunks: AsyncIterator[str]):
+        self._chunks = chunks
+        self._decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    async def _fill(self) -> bool:
+        if self.eof:
+            return False
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self.eof = True
+            return False
+        if self.pos > CHUNK_SIZE:
+            self.buf, self.pos = self.buf[self.pos:], 0
+        self.buf += chunk
+        return True
+
+    async def peek(self) -> str:
+        """Следующий значимый символ (без пробелов); '' — конец потока."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self._fill():
+                return ""
+
+    async def expect(self, ch: str):
+        got = await self.peek()
+        if got != ch:
+            raise CatalogFormatError(f"ожидался {ch!r}, получено {got or 'конец файла'!r}")
+        self.pos += 1
+
+    async def value(self) -> Any:
+        await self.peek()
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if await self._fill():
+                    continue
+                raise CatalogFormatError(f"некорректный JSON: {e.msg}") from None
+            # число на границе куска могло прочитаться не полностью
+            if end == len(self.buf) and await self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    async def items(self) -> AsyncIterator[None]:
+        """Обход элементов массива: после каждого yield вызывающий читает один элемент."""
+        await self.expect("[")
+        if await self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            ch = await self.peek()
+            self.pos += 1
+            if ch == "]":
+                return
+            if ch != ",":
+                raise CatalogFormatError("ожидалась ',' или ']' в массиве")
+
+    async def keys(self) -> AsyncIterator[str]:
+        """Обход ключей объекта: после каждого yield вызывающий читает значение."""
+        await self.expect("{")
+        if await self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = await self.value()
+            if not isinstance(key, str):
+                raise CatalogFormatError("ключ объекта должен быть строкой")
+            await self.expect(":")
+            yield key
+            ch = await self.peek()
+            self.pos += 1
+            if ch == "}":
+                return
+            if ch != ",":
+                raise CatalogFormatError("ожидалась ',' или '}' в объекте")
+
+
+async def iter_catalog_categories(
+    chunks: AsyncIterator[str],
+) -> AsyncIterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """Пары (поля категории без items, товары категории) по мере чтения потока."""
+    stream = _JsonStream(chunks)
+    async for key in stream.keys():
+        if key != "categories":
+            await stream.value()
+            continue
+        async for _ in stream.items():
+            cat: Dict[str, Any] = {}
+            items: List[Dict[str, Any]] = []
+            async for ckey in stream.keys():
+                if ckey == "items":
+                    async for _ in stream.items():
+                        items.append(await stream.value())
+                else:
+                    cat[ckey] = await stream.value()
+            yield cat, items
+    if await stream.peek():
+        raise CatalogFormatError("лишние данные после каталога")
+
+
+def _product_row(cat: Dict[str, Any], item: Any, sort_order: int) -> Optional[Dict[str, Any]]:
+    if not isinstance(item, dict):
+        return None
+    sku = str(item.get("sku") or "").strip()
+    title = str(item.get("title") or sku).strip()
+    try:
+        price_minor = int(round(float(item.get("price_rub", 0)) * 100))
+    except (TypeError, ValueError):
+        return None
+    if not sku or price_minor <= 0:
+        return None
+    slug = str(cat.get("id") or cat.get("slug") or "general")
+    return {
+        "sku": sku,
+        "title": title,
+        "price_minor": price_minor,
+        "available": 1 if item.get("available", True) else 0,
+        "sort_order": sort_order,
+        "category_slug": slug,
+        "category_title": str(cat.get("title") or slug),
+    }
+
+
+async def _url_chunks(url: str) -> AsyncIterator[str]:
+    async with httpx.AsyncClient(timeout=30) as c:
+        async with c.stream("GET", url) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_text(CHUNK_SIZE):
+                yield chunk
+
+
+async def _file_chunks(path: str) -> AsyncIterator[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            yield chunk
+
+
+async def import_catalog(url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Загрузить каталог (URL из settings/.env или локальный catalog.json) потоково
+    и применить к таблице products одной транзакцией (см. db_import_products).
+    Возвращает счётчики added/updated/deactivated/unchanged/skipped и seconds.
+    Если в выгрузке нет ни одного корректного товара, БД не трогается.
+    """
+    t0 = time.monotonic()
+    if url is None:
+        url = await db_get_setting("catalog_url", DEFAULT_CATALOG_URL)
+    chunks = _url_chunks(url) if url else _file_chunks("catalog.json")
+
+    by_sku: Dict[str, Dict[str, Any]] = {}
+    skipped = 0
+    async for cat, items in iter_catalog_categories(chunks):
+        for n, item in enumerate(items):
+            row = _product_row(cat, item, n)
+            if row is None:
+                skipped += 1
+                continue
+            # повтор SKU в выгрузке — действует последнее вхождение
+            by_sku.pop(row["sku"], None)
+            by_sku[row["sku"]] = row
+    if not by_sku:
+        raise CatalogFormatError("в каталоге нет ни одного товара")
+
+    result: Dict[str, Any] = await db_import_products(list(by_sku.values()))
+    result["skipped"] = skipped
+    result["seconds"] = time.monotonic() - t0
+    print(
+        f"[CATALOG] Импорт: +{result['added']} ~{result['updated']} -{result['deactivated']} "
+        f"={result['unchanged']} пропущено {skipped} за {result['seconds']:.2f}s"
+    )
+    return result
@@ -1,50 +1,107 @@
+from typing import Optional
+
 from aiogram import Router, F
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.db import (
-    db_get_user_by_tg, db_get_or_create_cart, db_get_cart_items,
-    db_update_order_totals, db_get_setting, db_get_order_basic, db_set_order_checkout,
-    db_clear_cart, db_get_product, db_list_products_public, db_add_item_to_cart
+    db_get_cart_items,
+    db_set_order_delivery_fee, db_get_courier_fee_minor, db_get_order_basic, db_set_order_checkout,
+    db_clear_cart, db_get_product, db_list_products_public, db_cart_add_product,
+    db_search_products_public
 )
-from app.keyboards import products_list_kb, product_detail_kb, cart_kb
+from app.keyboards import MENU_TEXTS, products_list_kb, product_detail_kb, cart_kb
+from app.middlewares import CartRef
+from app.states import Search
 
 router = Router()
 
 PAGE_SIZE = 10
 
+def _parse_cursor(parts: list[str]):
+    # parts: ["<n|p|a>", "<sort_order>", "<id>"]; иначе — первая страница
+    if len(parts) == 3 and parts[0] in ("n", "p", "a"):
+        try:
+            return parts[0], int(parts[1]), int(parts[2])
+        except ValueError:
+            return None
+    return None
+
+# Хендлеры состояния поиска стоят первыми в роутере: иначе «Каталог» и другие
+# кнопки меню ниже ответили бы, не сбросив ожидание запроса.
+# Кнопка меню или команда вместо поискового запроса:
+_NOT_A_QUERY = F.text.in_(MENU_TEXTS) | F.text.startswith("/")
+
+@router.message(Search.waiting_query, _NOT_A_QUERY)
+async def search_leave(message: Message, state: FSMContext):
+    # выходим из поиска, а само сообщение обработает его обычный хендлер
+    await state.clear()
+    raise SkipHandler
+
+@router.message(Search.waiting_query, ~_NOT_A_QUERY)
+async def search_query(message: Message, state: FSMContext):
+    query = (message.text or "").strip()
+    if len(query) < 2:
+        await message.answer("Слишком короткий запрос. Введите хотя бы 2 символа.")
+        return
+    await state.clear()
+    await _answer_search(message, query)
+
 @router.message(F.text == "Каталог")
 async def show_catalog(message: Message):
-    items, total = await db_list_products_public(page=1, page_size=PAGE_SIZE)
+    items, total, has_prev, has_next = await db_list_products_public(page_size=PAGE_SIZE)
     if not total:
         await message.answer("Каталог пуст. Обратитесь к администратору.")
         return
-    await message.answer("Выберите товар:", reply_markup=products_list_kb(items, 1, total, PAGE_SIZE))
+    kb = products_list_kb(items, has_prev, has_next, cache_key=(None, PAGE_SIZE))
+    await message.answer("Выберите товар:", reply_markup=kb)
 
 @router.callback_query(F.data.startswith("plist:"))
 async def paged_list(cb: CallbackQuery):
-    try:
-        page = int(cb.data.split(":")[1])
-    except:
-        page = 1
-    page = max(1, page)
-    items, total = await db_list_products_public(page=page, page_size=PAGE_SIZE)
+    # формат: plist:<n|p|a>:<sort_order>:<id> (plist:1 — первая страница)
+    cursor = _parse_cursor(cb.data.split(":")[1:])
+    items, total, has_prev, has_next = await db_list_products_public(page_size=PAGE_SIZE, cursor=cursor)
     if not total:
         await cb.answer("Каталог пуст.", show_alert=True); return
-    await cb.message.edit_text("Выберите товар:", reply_markup=products_list_kb(items, page, total, PAGE_SIZE))
+    kb = products_list_kb(items, has_prev, has_next, cache_key=(cursor, PAGE_SIZE))
+    await cb.message.edit_text("Выберите товар:", reply_markup=kb)
+
+async def _answer_search(message: Message, query: str):
+    items, total = await db_search_products_public(query, page=1, page_size=PAGE_SIZE)
+    if not items:
+        await message.answer("Ничего не найдено. Попробуйте другое слово или откройте «Каталог».")
+        return
+    head = f"Найдено: {total}" + (f" (показаны первые {len(items)})" if total > len(items) else "")
+    await message.answer(head + "\nВыберите товар:", reply_markup=products_list_kb(items, False, False))
+
+@router.message(Command("search"))
+async def search_command(message: Message, command: CommandObject, state: FSMContext):
+    if not command.args:
+        await message.answer("Введите название товара для поиска:")
+        await state.set_state(Search.waiting_query)
+        return
+    await _answer_search(message, command.args)
+
+@router.message(F.text == "Поиск")
+async def search_start(message: Message, state: FSMContext):
+    await message.answer("Введите название товара для поиска:")
+    await state.set_state(Search.waiting_query)
 
 @router.callback_query(F.data.startswith("view:"))
 async def view_item(cb: CallbackQuery):
-    # формат: view:<prod_id>:p:<page>
+    # формат: view:<prod_id>:a:<sort_order>:<id> — курсор страницы для возврата
     parts = cb.data.split(":")
     prod_id = int(parts[1])
-    page = int(parts[3]) if len(parts) > 3 else 1
+    back = ":".join(parts[2:]) if _parse_cursor(parts[2:]) else "1"
     p = await db_get_product(prod_id)
     if not p or not p["available"]:
         await cb.answer("Товар недоступен", show_alert=True)
         return
     text = f"📦 {p['title']}\nЦена: {p['price_minor']/100:.2f} ₽"
-    kb = product_detail_kb(prod_id=p["id"], page=page)
+    kb = product_detail_kb(prod_id=p["id"], back=back)
     if p.get("photo_file_id"):
         await cb.message.answer_photo(photo=p["photo_file_id"], caption=text, reply_markup=kb)
         await cb.answer()
@@ -58,69 +115,67 @@ async def add_item(cb: CallbackQuery):
     if not p or not p["available"]:
         await cb.answer("Товар недоступен", show_alert=True)
         return
-    user = await db_get_user_by_tg(cb.from_user.id)
-    if not user:
+    order_id = await db_cart_add_product(cb.from_user.id, p)
+    if order_id is None:
         await cb.answer("Сначала зарегистрируйтесь: /start", show_alert=True)
         return
-    order_id = await db_get_or_create_cart(user["id"])
-    await db_add_item_to_cart(order_id, p["sku"], p["title"], p["price_minor"])
-    await db_update_order_totals(order_id, 0)
     await cb.answer("Добавлено в корзину")
 
 @router.message(F.text == "Корзина")
-async def cart(message: Message):
-    user = await db_get_user_by_tg(message.from_user.id)
+async def cart(message: Message, user: Optional[dict], cart: CartRef):
     if not user:
         await message.answer("Сначала зарегистрируйтесь: /start")
         return
-    order_id = await db_get_or_create_cart(user["id"])
+    order_id = await cart.id()
     items = await db_get_cart_items(order_id)
     if not items:
         await message.answer("Корзина пуста. Откройте «Каталог» и добавьте товары.")
         return
-    subtotal = sum(i["unit_price_minor"] * i["qty"] for i in items)
+    order = await db_get_order_basic(order_id)
     lines = ["Корзина:"]
     for it in items:
         lines.append(f"- {it['title']} x{it['qty']} = {(it['unit_price_minor']*it['qty'])/100:.2f} ₽")
-    lines.append(f"Итого по товарам: {subtotal/100:.2f} ₽")
+    # сумму ведут триггеры БД, заново не складываем
+    lines.append(f"Итого по товарам: {order['subtotal_minor']/100:.2f} ₽")
     await message.answer("\n".join(lines), reply_markup=cart_kb(True))
 
 @router.callback_query(F.data == "cart_clear")
-async def cart_clear(cb: CallbackQuery):
-    user = await db_get_user_by_tg(cb.from_user.id)
+async def cart_clear(cb: CallbackQuery, user: Optional[dict], cart: CartRef):
     if not user:
         await cb.answer("Сначала /start", show_alert=True)
         return
-    order_id = await db_get_or_create_cart(user["id"])
+    order_id = await cart.id()
     await db_clear_cart(order_id)
-    items, total = await db_list_products_public(page=1, page_size=PAGE_SIZE)
-    await cb.message.edit_text("Корзина очищена.", reply_markup=products_list_kb(items, 1, total, PAGE_SIZE))
+    items, _, has_prev, has_next = await db_list_products_public(page_size=PAGE_SIZE)
+    kb = products_list_kb(items, has_prev, has_next, cache_key=(None, PAGE_SIZE))
+    await cb.message.edit_text("Корзина очищена.", reply_markup=kb)
 
 @router.callback_query(F.data == "checkout")
-async def checkout(cb: CallbackQuery):
-    user = await db_get_user_by_tg(cb.from_user.id)
+async def checkout(cb: CallbackQuery, user: Optional[dict], cart: CartRef):
     if not user:
         await cb.answer("Сначала /start", show_alert=True)
         return
-    order_id = await db_get_or_create_cart(user["id"])
+    order_id = await cart.id()
     items = await db_get_cart_items(order_id)
     if not items:
         await cb.answer("Корзина пуста.", show_alert=True)
         return
-    courier_fee_minor = int(await db_get_setting("courier_fee_minor", "15000"))
-    await db_update_order_totals(order_id, 0)
+    courier_fee_minor = await db_get_courier_fee_minor()
+    await db_set_order_delivery_fee(order_id, 0)
     from app.keyboards import delivery_kb
     await cb.message.edit_text("Выберите способ доставки:", reply_markup=delivery_kb(courier_fee_minor))
 
 @router.callback_query(F.data.startswith("deliv:"))
-async def select_delivery(cb: CallbackQuery):
+async def select_delivery(cb: CallbackQuery, user: Optional[dict], cart: CartRef):
     from app.db import db_get_default_address, db_get_order_basic
     from app.utils import format_address
 
     kind = cb.data.split(":")[1]  # pickup/courier
-    user = await db_get_user_by_tg(cb.from_user.id)
-    order_id = await db_get_or_create_cart(user["id"])
-    courier_fee_minor = int(await db_get_setting("courier_fee_minor", "15000"))
+    if not user:
+        await cb.answer("Сначала /start", show_alert=True)
+        return
+    order_id = await cart.id()
+    courier_fee_minor = await db_get_courier_fee_minor()
 
     addr_snap = None
     if kind == "courier":
@@ -135,9 +190,9 @@ async def select_delivery(cb: CallbackQuery):
             "floor": addr.get("floor"),
             "comment": addr.get("comment")
         }
-        await db_update_order_totals(order_id, courier_fee_minor)
+        await db_set_order_delivery_fee(order_id, courier_fee_minor)
     else:
-        await db_update_order_totals(order_id, 0)
+        await db_set_order_delivery_fee(order_id, 0)
 
     order = await db_get_order_basic(order_id)
     items = await db_get_cart_items(order_id)
@@ -156,10 +211,12 @@ async def select_delivery(cb: CallbackQuery):
     await cb.message.edit_text("\n".join(lines), reply_markup=kb)
 
 @router.callback_query(F.data.startswith("confirm:"))
-async def confirm_order(cb: CallbackQuery):
+async def confirm_order(cb: CallbackQuery, user: Optional[dict], cart: CartRef):
     kind = cb.data.split(":")[1]
-    user = await db_get_user_by_tg(cb.from_user.id)
-    order_id = await db_get_or_create_cart(user["id"])
+    if not user:
+        await cb.answer("Сначала /start", show_alert=True)
+        return
+    order_id = await cart.id()
     from app.db import db_get_default_address
     addr = await db_get_default_address(user["id"]) if kind == "courier" else None
     await db_set_order_checkout(order_id, kind, addr)
@@ -0,0 +1,237 @@
+"""
+Проверка планов запросов db.py.
+
+Прогоняет функции db.py на небольшой временной БД, записывает каждый
+выполненный SQL (с функцией, из которой он выполнен) и для каждого делает
+EXPLAIN QUERY PLAN. Падает (код возврата 1), если где-то есть полный проход
+по таблице (SCAN без индекса) или временное B-дерево для ORDER BY / GROUP BY
+/ DISTINCT — значит, запросу не хватает индекса.
+
+Функциям, которым полный проход или сортировка нужны по смыслу (загрузка
+всего каталога в кэш, пересчёт агрегатов и т.п.), в ALLOWED разрешены
+конкретные шаги плана — с причиной.
+Миграции (_migrate_*) выполняются один раз и не проверяются.
+
+Запуск:
+    python -m app.check_query_plans
+    python -m app.check_query_plans --verbose   # показать планы всех запросов
+"""
+import argparse
+import asyncio
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+if __name__ == "__main__":
+    os.environ.setdefault("BOT_TOKEN", "42:CHECK")
+
+from app import db as app_db  # noqa: E402  (BOT_TOKEN должен быть задан до импорта)
+
+# функция db.py -> (шаг плана, который ей разрешён, почему)
+ALLOWED: Dict[str, Tuple[str, str]] = {
+    "_catalog_ensure": (r"SCAN products$|TEMP B-TREE FOR ORDER BY", "весь каталог загружается в кэш раз на изменение"),
+    "_settings_ensure": (r"SCAN settings$", "таблица настроек читается целиком раз за запуск"),
+    "db_import_products": (r"SCAN products$", "выгрузка сравнивается со всеми товарами"),
+    "db_list_categories": (r"SCAN categories$", "справочник категорий выводится целиком (по rowid)"),
+    "db_list_products_admin": (r"SCAN p$", "обход по rowid с конца, читается только LIMIT строк"),
+    "_sales_apply": (r"TEMP B-TREE FOR GROUP BY", "группировка по вычисляемому часу/дню в пределах пачки заказов"),
+    "db_sales_report": (r"TEMP B-TREE FOR (GROUP|ORDER) BY", "сводка по строкам агрегатов за период"),
+}
+
+SKIP_PREFIXES = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "CREATE", "ALTER", "DROP")
+
+# (функция, SQL без лишних пробелов) -> параметры первого вызова
+_recorded: Dict[Tuple[str, str], Any] = {}
+
+
+def _record(query: str, sql: str, params: Any):
+    key = (query, " ".join(sql.split()))
+    _recorded.setdefault(key, params)
+
+
+def _install_recorder():
+    execute = app_db._TimedConnection.execute
+    executemany = app_db._TimedConnection.executemany
+
+    async def recording_execute(self, sql: str, *args: Any):
+        _record(app_db._caller_name(2), sql, args[0] if args else ())
+        return await execute(self, sql, *args)
+
+    async def recording_executemany(self, sql: str, parameters: Any):
+        parameters = list(parameters)
+        _record(app_db._caller_name(2), sql, parameters[0] if parameters else ())
+        return await executemany(self, sql, parameters)
+
+    app_db._TimedConnection.execute = recording_execute
+    app_db._TimedConnection.executemany = recording_executemany
+
+
+# ---------------------- WORKLOAD ----------------------
+async def _workload():
+    """Вызвать все функции db.py, которые обращаются к БД, по всем веткам запросов."""
+    await app_db.init_db()
+    await app_db.db_set_setting("courier_fee_minor", "15000")
+    await app_db.db_get_courier_fee_minor()
+
+    cat_id = await app_db.db_create_category("Выпечка", "bakery")
+    await app_db.db_update_category_title(cat_id, "Свежая выпечка")
+    await app_db.db_get_category(cat_id)
+    await app_db.db_list_categories()
+    await app_db.db_get_or_create_general_category_id()
+    await app_db.db_get_or_create_general_category_id()
+    product_ids = [
+        await app_db.db_create_product(cat_id, f"Булочка {i}", 5000 + i, f"B-{i}", sort_order=i % 3)
+        for i in range(30)
+    ]
+    pid = product_ids[0]
+    await app_db.db_update_product_title(pid, "Булочка с маком")
+    await app_db.db_update_product_price(pid, 6000)
+    await app_db.db_set_product_available(product_ids[1], 0)
+    await app_db.db_update_product_photo(pid, "photo")
+    await app_db.db_update_product_sku(pid, "B-0-NEW")
+    await app_db.db_update_product_sort_order(pid, 5)
+    await app_db.db_count_products_in_category(cat_id)
+    await app_db.db_list_products_by_category_admin(cat_id)
+    await app_db.db_list_products_admin()
+    await app_db.db_get_product(pid)
+    await app_db.db_find_product_by_sku("B-2")
+    page, _, _, _ = await app_db.db_list_products_public(10)
+    await app_db.db_search_products_public("булоч", 1, 10)
+    # запасной путь листинга (когда кэш каталога недоступен): все ветки курсора
+    first = page[0]
+    for category_id in (None, cat_id):
+        await app_db._db_list_products_keyset(None, 10, category_id)
+        for direction in ("n", "p", "a"):
+            await app_db._db_list_products_keyset((direction, first["sort_order"], first["id"]), 10, category_id)
+    await app_db.db_import_products([{
+        "sku": "IMP-1", "title": "Багет", "price_minor": 9000, "available": 1,
+        "sort_order": 0, "category_slug": "bread", "category_title": "Хлеб",
+    }], deactivate_missing=False)
+    await app_db.db_delete_product(product_ids[-1])
+
+    order_ids: List[int] = []
+    for tg_id in range(1000, 1010):
+        await app_db.db_create_or_update_user_base(tg_id, f"User {tg_id}")
+        await app_db.db_set_user_phone_verified(tg_id, f"+7900000{tg_id}")
+        user = await app_db.db_get_user_by_tg(tg_id)
+        await app_db.db_set_default_address(user["id"], {"address_line": "Ленина 1", "apt": "5"})
+        address = await app_db.db_get_default_address(user["id"])
+        for p in page[:3]:
+            order_id = await app_db.db_cart_add_product(tg_id, p)
+        await app_db.db_add_item_to_cart(order_id, "B-5", "Булочка 5", 5005)
+        await app_db.db_get_cart_items(order_id)
+        await app_db.db_set_order_delivery_fee(order_id, 15000)
+        await app_db.db_set_order_checkout(order_id, "courier", address)
+        order_ids.append(order_id)
+    cart_id = await app_db.db_get_or_create_cart(user["id"])
+    await app_db.db_add_item_to_cart(cart_id, "B-7", "Булочка 7", 5007)
+    await app_db.db_clear_cart(cart_id)
+    await app_db.db_get_order_basic(order_ids[0])
+
+    await app_db.db_set_order_status(order_ids[0], "preparing")
+    await app_db.db_set_orders_status(order_ids[:6], "delivered")
+    await app_db.db_set_orders_status(order_ids[6:8], "canceled")
+    await app_db.db_set_orders_status(order_ids[:2], "canceled")
+    await app_db.db_get_user_active_orders()
+    await app_db.db_count_orders_by_status()
+    rows, _, _ = await app_db.db_list_orders_board(None, 2)
+    await app_db.db_list_orders_board(None, 2, ("n", rows[-1]["id"]))
+    await app_db.db_list_orders_board("confirming", 2, ("p", rows[0]["id"]))
+    day = (await app_db.db_get_order_basic(order_ids[0]))["checked_out_at"][:10]
+    await app_db.db_sales_report(day, day)
+    await app_db.db_rebuild_sales_aggregates()
+
+    await app_db.db_fsm_flush([("1:1:1", "S:a", "{}", 1.0), ("1:2:2", None, '{"x": 1}', 2.0)], ["1:3:3"])
+    await app_db.db_fsm_get("1:1:1")
+    await app_db.db_fsm_purge(1.5)
+
+    await app_db.db_delete_category(await app_db.db_create_category("Пусто", "empty"))
+    await app_db.close_db()
+
+
+# ---------------------- STATISTICS ----------------------
+HISTORY_ORDERS = 20000
+
+
+def _analyze_like_production(conn: sqlite3.Connection):
+    """
+    Дописать историю завершённых заказов и собрать по ним статистику (ANALYZE).
+    Статистика, которую собрал PRAGMA optimize в close_db, описывает десятки
+    строк нагрузки — по ней планировщику везде дешевле полный проход, и
+    проверялись бы не те планы, что в работе. В рабочей БД заказов много,
+    активных среди них малая доля; остальные таблицы проверяем без статистики.
+    """
+    conn.execute("DELETE FROM sqlite_stat1")
+    user_id = conn.execute("SELECT MIN(id) FROM users").fetchone()[0]
+    conn.executemany(
+        "INSERT INTO orders(user_id, status, delivery_type, created_at, checked_out_at) VALUES(?, ?, 'pickup', ?, ?)",
+        ((user_id, "canceled" if i % 10 == 0 else "delivered", "2024-01-01T00:00:00", "2024-01-01T00:00:00")
+         for i in range(HISTORY_ORDERS))
+    )
+    conn.commit()
+    conn.execute("ANALYZE orders")
+
+
+# ---------------------- CHECK ----------------------
+def _problems(plan: List[str]) -> List[str]:
+    bad = []
+    for detail in plan:
+        if "TEMP B-TREE" in detail:
+            bad.append(detail)
+        elif re.match(r"SCAN \w+( AS \w+)?$", detail):
+            # SCAN <таблица> без USING INDEX / VIRTUAL TABLE — полный проход
+            bad.append(detail)
+    return bad
+
+
+def _explain(conn: sqlite3.Connection, sql: str, params: Any) -> Optional[List[str]]:
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f"ошибка EXPLAIN: {e}"]
+    return [r[3] for r in rows]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка планов запросов db.py")
+    parser.add_argument("--verbose", action="store_true", help="показать планы всех запросов")
+    args = parser.parse_args(argv)
+
+    # всегда своя временная БД: пакет app мог импортировать db.py раньше нас,
+    # с DB_PATH рабочей базы
+    app_db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="check_plans_"), "check.db")
+    _install_recorder()
+    asyncio.run(_workload())
+
+    conn = sqlite3.connect(app_db.DB_PATH)
+    _analyze_like_production(conn)
+    failed = 0
+    checked = 0
+    for (query, sql), params in sorted(_recorded.items()):
+        if query.startswith("_migrate_") or sql.upper().startswith(SKIP_PREFIXES):
+            continue
+        plan = _explain(conn, sql, params)
+        if not plan:
+            continue  # INSERT ... VALUES и т.п. — без чтения таблиц
+        checked += 1
+        bad = _problems(plan)
+        pattern = ALLOWED.get(query, ("", ""))[0]
+        unexpected = [d for d in bad if not (pattern and re.search(pattern, d))]
+        if unexpected:
+            failed += 1
+        if args.verbose or unexpected:
+            mark = "FAIL" if unexpected else ("ok*" if bad else "ok")
+            print(f"[{mark}] {query}: {sql[:150]}")
+            for detail in plan:
+                print(f"         {detail}")
+    conn.close()
+
+    print(f"Проверено запросов: {checked}, проблемных: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
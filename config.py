@@ -9,12 +9,60 @@ if not BOT_TOKEN:
 
 ADMIN_TG_IDS = {int(x) for x in os.getenv("ADMIN_TG_IDS", "").split(",") if x.strip().isdigit()}
 DEFAULT_COURIER_FEE_RUB = int(os.getenv("COURIER_FEE_RUB", "150"))
-DB_PATH = "bot_store.db"
+DB_PATH = os.getenv("DB_PATH", "bot_store.db").strip() or "bot_store.db"
+# Выгрузка каталога поставщика для /refresh; пусто — локальный catalog.json
+DEFAULT_CATALOG_URL = os.getenv("CATALOG_URL", "").strip()
 
 # SMS / OTP
-SMS_PROVIDER = os.getenv("SMS_PROVIDER", "dev").strip().lower()  # sms_ru | dev
+SMS_PROVIDER = os.getenv("SMS_PROVIDER", "dev").strip().lower()  # sms_ru | dev | mock
 SMS_API_KEY = os.getenv("SMS_API_KEY", "").strip()
 SMS_SENDER = os.getenv("SMS_SENDER", "").strip()
+# Очередь исходящих SMS: воркеры, длина очереди, общий лимит (сообщений/с, 0 — без лимита),
+# пауза между SMS на один номер, число попыток при сбоях шлюза
+SMS_WORKERS = int(os.getenv("SMS_WORKERS", "2"))
+SMS_QUEUE_SIZE = int(os.getenv("SMS_QUEUE_SIZE", "1000"))
+SMS_RATE_PER_SECOND = float(os.getenv("SMS_RATE_PER_SECOND", "5"))
+SMS_PHONE_INTERVAL_SECONDS = int(os.getenv("SMS_PHONE_INTERVAL_SECONDS", "60"))
+SMS_MAX_ATTEMPTS = int(os.getenv("SMS_MAX_ATTEMPTS", "3"))
+SMS_MOCK_DELAY_MS = int(os.getenv("SMS_MOCK_DELAY_MS", "0"))  # задержка заглушки mock
 OTP_TTL_MINUTES = int(os.getenv("OTP_TTL_MINUTES", "5"))
 OTP_CODE_LENGTH = int(os.getenv("OTP_CODE_LENGTH", "4"))
 OTP_SECRET = os.getenv("OTP_SECRET", "change_me")
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))  # попыток ввода на один код
+OTP_RESEND_COOLDOWN_SECONDS = int(os.getenv("OTP_RESEND_COOLDOWN_SECONDS", "60"))
+
+# Получение апдейтов: polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()  # публичный https-адрес; пусто — только локальный сервер
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+
+# FSM-состояния в SQLite: сколько хранить брошенные сценарии и сколько ключей держать в памяти
+FSM_STATE_TTL_HOURS = int(os.getenv("FSM_STATE_TTL_HOURS", "72"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "5000"))
+
+# Параллельная обработка апдейтов: число одновременно обрабатываемых апдейтов и запас
+# очереди на воркер (принимается не больше UPDATE_WORKERS * UPDATE_QUEUE_SIZE)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "100"))
+
+# Метрики Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics; 0 — не поднимать HTTP-сервер
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Лимиты исходящих сообщений в Telegram: на бота в целом и на один чат (сообщений/с),
+# сколько сообщений подряд можно в чат без паузы и сколько общих токенов оставлять ответам пользователям
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_INTERACTIVE_RESERVE = float(os.getenv("SEND_INTERACTIVE_RESERVE", "5"))
+
+# Уведомления покупателям о смене статуса: воркеры фоновой очереди и её длина
+NOTIFY_WORKERS = int(os.getenv("NOTIFY_WORKERS", "4"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "10000"))
+
+# Часовой пояс отчётов о продажах (смещение от UTC, часы). После изменения
+# пересчитайте агрегаты: /report rebuild
+REPORT_UTC_OFFSET_HOURS = int(os.getenv("REPORT_UTC_OFFSET_HOURS", "0"))
@@ -1,9 +1,17 @@
+import asyncio
 import json
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator, Awaitable, Callable
 
 import aiosqlite
-from app.config import DB_PATH
+from app.config import DB_PATH, REPORT_UTC_OFFSET_HOURS
+from app.utils import format_address
 
 # ---------------------- DDL ----------------------
 CREATE_SQL = [
@@ -52,6 +60,7 @@ CREATE_SQL = [
         available INTEGER NOT NULL DEFAULT 1,
         photo_file_id TEXT,
         sort_order INTEGER NOT NULL DEFAULT 0,
+        from_feed INTEGER NOT NULL DEFAULT 0,  -- 1 — пришёл из выгрузки каталога (db_import_products)
         FOREIGN KEY(category_id) REFERENCES categories(id)
     );
     """,
@@ -66,7 +75,9 @@ CREATE_SQL = [
         subtotal_minor INTEGER NOT NULL DEFAULT 0,
         total_minor INTEGER NOT NULL DEFAULT 0,
         address_snapshot TEXT,
-        created_at TEXT NOT NULL,
+        address_text TEXT,    -- готовая строка адреса для админки (NULL — самовывоз)
+        created_at TEXT NOT NULL,    -- создание корзины
+        checked_out_at TEXT,         -- оформление (NULL — ещё корзина)
         FOREIGN KEY(user_id) REFERENCES users(id)
     );
     """,
@@ -88,22 +99,177 @@ CREATE_SQL = [
         key TEXT PRIMARY KEY,
         value TEXT NOT NULL
     );
+    """,
+    # Состояния FSM (app.fsm_storage): ключ бот/чат/пользователь, данные — JSON
+    """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL
+    );
     """
 ]
 
+# Суммы заказа ведёт сама БД (миграция 7): каждая вставка, изменение или удаление
+# строки order_items сдвигает subtotal_minor и total_minor своего заказа на
+# разницу, смена delivery_fee_minor пересчитывает total_minor. Стоимость
+# изменения не зависит от числа строк в заказе, а прочитанным суммам можно верить.
+ORDER_TOTALS_TRIGGERS_SQL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS order_items_totals_ai AFTER INSERT ON order_items BEGIN
+        UPDATE orders
+           SET subtotal_minor = subtotal_minor + new.unit_price_minor * new.qty,
+               total_minor = total_minor + new.unit_price_minor * new.qty
+         WHERE id = new.order_id;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS order_items_totals_ad AFTER DELETE ON order_items BEGIN
+        UPDATE orders
+           SET subtotal_minor = subtotal_minor - old.unit_price_minor * old.qty,
+               total_minor = total_minor - old.unit_price_minor * old.qty
+         WHERE id = old.order_id;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS order_items_totals_au
+    AFTER UPDATE OF order_id, unit_price_minor, qty ON order_items BEGIN
+        UPDATE orders
+           SET subtotal_minor = subtotal_minor - old.unit_price_minor * old.qty,
+               total_minor = total_minor - old.unit_price_minor * old.qty
+         WHERE id = old.order_id;
+        UPDATE orders
+           SET subtotal_minor = subtotal_minor + new.unit_price_minor * new.qty,
+               total_minor = total_minor + new.unit_price_minor * new.qty
+         WHERE id = new.order_id;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS orders_delivery_fee_au
+    AFTER UPDATE OF delivery_fee_minor ON orders
+    WHEN new.delivery_fee_minor IS NOT old.delivery_fee_minor BEGIN
+        UPDATE orders SET total_minor = subtotal_minor + new.delivery_fee_minor WHERE id = new.id;
+    END;
+    """
+]
+
+ACTIVE_ORDER_STATUSES = ("confirming", "preparing", "delivering")
+# Те же статусы литералом: частичный индекс idx_orders_active применяется,
+# только если в запросе условие записано так же, как в индексе
+ACTIVE_ORDER_STATUSES_SQL = ",".join(f"'{s}'" for s in ACTIVE_ORDER_STATUSES)
+# Отбор по статусу в запросах заказов пишется как unlikely(status IN (...)):
+# активных заказов малая доля, но без STAT4 статистика ANALYZE этого не
+# выражает, и для «всех активных» планировщик выбрал бы полный проход по orders
+
+# Индексы (миграция 6, планы проверяет check_query_plans.py). Базы без версии
+# схемы несут индексы, которые прежний init_db создавал на каждом запуске: дубли
+# UNIQUE-ограничений и префиксы других индексов только замедляли запись — их
+# удаляем. Остальные — под витрину, адреса и доску заказов, чтобы эти запросы
+# не сортировали и не сканировали таблицы.
 INDEX_SQL = [
-    "CREATE INDEX IF NOT EXISTS idx_users_tg ON users(tg_id)",
-    "CREATE INDEX IF NOT EXISTS idx_categories_slug ON categories(slug)",
-    "CREATE INDEX IF NOT EXISTS idx_products_cat ON products(category_id)",
-    "CREATE INDEX IF NOT EXISTS idx_products_avail ON products(available)",
-    "CREATE INDEX IF NOT EXISTS idx_products_sort ON products(sort_order, id DESC)",
-    "CREATE INDEX IF NOT EXISTS idx_products_sku ON products(sku)",
-    "CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders(user_id, status)",
-    "CREATE INDEX IF NOT EXISTS idx_items_order ON order_items(order_id)"
+    "DROP INDEX IF EXISTS idx_users_tg",            # дубль UNIQUE(users.tg_id)
+    "DROP INDEX IF EXISTS idx_categories_slug",     # дубль UNIQUE(categories.slug)
+    "DROP INDEX IF EXISTS idx_products_sku",        # дубль UNIQUE(products.sku)
+    "DROP INDEX IF EXISTS idx_items_order",         # префикс ux_items_order_sku(order_id, sku)
+    "DROP INDEX IF EXISTS idx_orders_user_status",  # корзину находит ux_orders_user_cart
+    "DROP INDEX IF EXISTS idx_products_avail",      # заменён idx_products_public
+    "DROP INDEX IF EXISTS idx_products_sort",       # заменён idx_products_public
+    "DROP INDEX IF EXISTS idx_products_cat",        # заменён idx_products_cat_sort
+    # витрина: только доступные товары в порядке показа; COUNT(*) — по индексу
+    "CREATE INDEX IF NOT EXISTS idx_products_public ON products(sort_order, id DESC) WHERE available = 1",
+    # товары категории в порядке показа (админка и витрина по категории);
+    # available в конце — счётчик категории не читает таблицу
+    "CREATE INDEX IF NOT EXISTS idx_products_cat_sort ON products(category_id, sort_order, id DESC, available)",
+    "CREATE INDEX IF NOT EXISTS idx_addresses_user ON addresses(user_id, is_default)",
+    # активные заказы по id: доска «все активные» и список активных без сортировки
+    f"CREATE INDEX IF NOT EXISTS idx_orders_active ON orders(id) WHERE status IN ({ACTIVE_ORDER_STATUSES_SQL})",
+    # доска заказов одного статуса
+    "CREATE INDEX IF NOT EXISTS idx_orders_status_id ON orders(status, id)",
+    "CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_states(updated_at)",
+]
+
+# Полнотекстовый поиск по товарам: external-content FTS5 поверх products,
+# синхронизируется триггерами. unicode61 приводит регистр (в т.ч. кириллицу),
+# prefix-индексы ускоряют запросы вида «пир*».
+FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        title, sku,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    );
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, title, sku) VALUES (new.id, new.title, new.sku);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, sku) VALUES ('delete', old.id, old.title, old.sku);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF title, sku ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, sku) VALUES ('delete', old.id, old.title, old.sku);
+        INSERT INTO products_fts(rowid, title, sku) VALUES (new.id, new.title, new.sku);
+    END;
+    """
 ]
 
 
+# Агрегаты продаж для отчётов: по часам и дням (по checked_out_at — времени
+# оформления заказа — в часовом поясе REPORT_UTC_OFFSET_HOURS) и по SKU за день. Обновляются при смене
+# статуса на delivered/canceled и обратно, так что отчёт не читает orders.
+SALES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS sales_hourly (
+        hour TEXT PRIMARY KEY,              -- 'YYYY-MM-DDTHH'
+        delivered_orders INTEGER NOT NULL DEFAULT 0,
+        revenue_minor INTEGER NOT NULL DEFAULT 0,
+        delivery_fee_minor INTEGER NOT NULL DEFAULT 0,
+        pickup_orders INTEGER NOT NULL DEFAULT 0,
+        courier_orders INTEGER NOT NULL DEFAULT 0,
+        canceled_orders INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_daily (
+        day TEXT PRIMARY KEY,               -- 'YYYY-MM-DD'
+        delivered_orders INTEGER NOT NULL DEFAULT 0,
+        revenue_minor INTEGER NOT NULL DEFAULT 0,
+        delivery_fee_minor INTEGER NOT NULL DEFAULT 0,
+        pickup_orders INTEGER NOT NULL DEFAULT 0,
+        courier_orders INTEGER NOT NULL DEFAULT 0,
+        canceled_orders INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_sku_daily (
+        day TEXT NOT NULL,
+        sku TEXT NOT NULL,
+        title TEXT NOT NULL,
+        units INTEGER NOT NULL DEFAULT 0,
+        revenue_minor INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, sku)
+    );
+    """
+]
+
 # ---------------------- MIGRATIONS ----------------------
+# Версия схемы хранится в PRAGMA user_version. init_db применяет только миграции
+# с номером больше текущего, все в одной транзакции, и на актуальной БД не
+# выполняет ни одного DDL. Базы, созданные до появления версий (user_version = 0),
+# проходят все шаги: каждый из них проверяет, что уже сделано, и безопасен
+# для повторного запуска.
+async def _migrate_base_schema(db: aiosqlite.Connection):
+    for sql in CREATE_SQL:
+        await db.execute(sql)
+    await _migrate_users_add_otp(db)
+    await _migrate_products_add_photo_sort(db)
+
 async def _migrate_users_add_otp(db: aiosqlite.Connection):
     cur = await db.execute("PRAGMA table_info(users)")
     cols = {r[1] for r in await cur.fetchall()}
@@ -122,84 +288,510 @@ async def _migrate_products_add_photo_sort(db: aiosqlite.Connection):
     if "sort_order" not in cols:
         await db.execute("ALTER TABLE products ADD COLUMN sort_order INTEGER NOT NULL DEFAULT 0")
 
+async def _migrate_cart_unique(db: aiosqlite.Connection):
+    """
+    Одна корзина на пользователя и одна строка на SKU в заказе.
+    Перед созданием уникальных индексов схлопываем накопившиеся дубликаты.
+    """
+    cur = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_items_order_sku'")
+    if await cur.fetchone() is None:
+        await db.execute("""
+            UPDATE order_items
+               SET qty = (SELECT SUM(i2.qty) FROM order_items i2
+                           WHERE i2.order_id = order_items.order_id AND i2.sku = order_items.sku)
+             WHERE id IN (SELECT MIN(id) FROM order_items GROUP BY order_id, sku HAVING COUNT(*) > 1)
+        """)
+        await db.execute("""
+            DELETE FROM order_items
+             WHERE id NOT IN (SELECT MIN(id) FROM order_items GROUP BY order_id, sku)
+        """)
+        await db.execute("CREATE UNIQUE INDEX ux_items_order_sku ON order_items(order_id, sku)")
+    cur = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ux_orders_user_cart'")
+    if await cur.fetchone() is None:
+        # лишние корзины (двойные нажатия) — оставляем самую свежую
+        await db.execute("""
+            UPDATE orders SET status = 'canceled'
+             WHERE status = 'cart'
+               AND id NOT IN (SELECT MAX(id) FROM orders WHERE status = 'cart' GROUP BY user_id)
+        """)
+        await db.execute("CREATE UNIQUE INDEX ux_orders_user_cart ON orders(user_id) WHERE status = 'cart'")
+
+async def _migrate_orders_add_address_text(db: aiosqlite.Connection):
+    cur = await db.execute("PRAGMA table_info(orders)")
+    cols = {r[1] for r in await cur.fetchall()}
+    if "address_text" in cols:
+        return
+    await db.execute("ALTER TABLE orders ADD COLUMN address_text TEXT")
+    # для старых заказов строку собираем из JSON-снимка один раз
+    cur = await db.execute("SELECT id, address_snapshot FROM orders WHERE address_snapshot IS NOT NULL")
+    rows = []
+    for r in await cur.fetchall():
+        try:
+            addr = json.loads(r["address_snapshot"] or "{}")
+        except ValueError:
+            continue
+        if addr:
+            rows.append((format_address(addr), r["id"]))
+    if rows:
+        await db.executemany("UPDATE orders SET address_text = ? WHERE id = ?", rows)
+
+async def _migrate_sales_aggregates(db: aiosqlite.Connection):
+    for sql in SALES_SQL:
+        await db.execute(sql)
+    # заполнение по уже завершённым заказам — в _migrate_orders_add_checked_out_at:
+    # агрегаты считаются по колонке, которая появляется только там
+
+async def _migrate_products_fts(db: aiosqlite.Connection):
+    cur = await db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+    existed = await cur.fetchone() is not None
+    for sql in FTS_SQL:
+        await db.execute(sql)
+    if not existed:
+        # индекс для товаров, созданных до появления FTS
+        await db.execute("INSERT INTO products_fts(products_fts) VALUES('rebuild')")
+
+async def _migrate_indexes(db: aiosqlite.Connection):
+    for sql in INDEX_SQL:
+        await db.execute(sql)
+
+async def _migrate_order_totals_triggers(db: aiosqlite.Connection):
+    for sql in ORDER_TOTALS_TRIGGERS_SQL:
+        await db.execute(sql)
+    # дальше суммы меняются только разницами — выравниваем их один раз. Оформленные
+    # заказы не трогаем: их суммы зафиксированы при оформлении и уже в агрегатах продаж
+    await db.execute("""
+        UPDATE orders
+           SET subtotal_minor = (SELECT COALESCE(SUM(unit_price_minor * qty), 0)
+                                   FROM order_items WHERE order_id = orders.id)
+         WHERE status = 'cart'
+    """)
+    await db.execute("UPDATE orders SET total_minor = subtotal_minor + delivery_fee_minor WHERE status = 'cart'")
+
+async def _migrate_orders_add_checked_out_at(db: aiosqlite.Connection):
+    cur = await db.execute("PRAGMA table_info(orders)")
+    cols = {r[1] for r in await cur.fetchall()}
+    if "checked_out_at" not in cols:
+        await db.execute("ALTER TABLE orders ADD COLUMN checked_out_at TEXT")
+    # время оформления старых заказов не сохранялось — берём создание корзины
+    await db.execute("UPDATE orders SET checked_out_at = created_at WHERE checked_out_at IS NULL AND status != 'cart'")
+    await _sales_rebuild(db)
+
+async def _migrate_products_add_from_feed(db: aiosqlite.Connection):
+    # прежние товары помечаются при первом импорте, в котором они встретятся;
+    # до того импорт их не скрывает
+    cur = await db.execute("PRAGMA table_info(products)")
+    cols = {r[1] for r in await cur.fetchall()}
+    if "from_feed" not in cols:
+        await db.execute("ALTER TABLE products ADD COLUMN from_feed INTEGER NOT NULL DEFAULT 0")
+
+# (номер, шаг). Новые миграции только дописываются в конец с номером на
+# единицу больше; выпущенные шаги не меняются и не переставляются.
+MIGRATIONS: List[Tuple[int, Callable[[aiosqlite.Connection], Awaitable[None]]]] = [
+    (1, _migrate_base_schema),
+    (2, _migrate_products_fts),
+    (3, _migrate_cart_unique),
+    (4, _migrate_orders_add_address_text),
+    (5, _migrate_sales_aggregates),
+    (6, _migrate_indexes),
+    (7, _migrate_order_totals_triggers),
+    (8, _migrate_orders_add_checked_out_at),
+    (9, _migrate_products_add_from_feed),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def _schema_version(db: aiosqlite.Connection) -> int:
+    cur = await db.execute("PRAGMA user_version")
+    row = await cur.fetchone()
+    await cur.close()
+    return int(row[0])
+
+
+# ---------------------- CONNECTION POOL ----------------------
+READER_POOL_SIZE = 4
+WRITE_BATCH_MAX = 64  # сколько записей максимум объединяем в одну транзакцию
+
+# WAL: читатели не блокируют писателя; synchronous=NORMAL в WAL безопасен
+# при падении процесса и делает fsync только на checkpoint.
+PRAGMA_SQL = [
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+]
+
+WriteJob = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+# Хук для замеров SQL: fn(query, seconds). query — имя функции db.py, из которой
+# выполнен запрос (например "db_cart_add_product"). None — замеры выключены.
+QueryObserver = Callable[[str, float], None]
+_query_observer: Optional[QueryObserver] = None
+
+
+def set_query_observer(fn: Optional[QueryObserver]):
+    global _query_observer
+    _query_observer = fn
+
+
+def _caller_name(depth: int) -> str:
+    frame = sys._getframe(depth)
+    code = frame.f_code
+    qualname = getattr(code, "co_qualname", None)
+    if qualname is None:
+        # Python 3.10: co_qualname ещё нет. Вложенные _job вызывает
+        # _Pool._commit_batch, а __qualname__ есть у самой функции job
+        job = frame.f_back.f_locals.get("job") if frame.f_back is not None else None
+        qualname = job.__qualname__ if getattr(job, "__code__", None) is code else code.co_name
+    # "db_cart_add_product.<locals>._job" -> "db_cart_add_product"
+    return qualname.split(".<locals>", 1)[0]
+
+
+class _TimedCursor:
+    """Курсор, выборка (fetch*) которого замеряется отдельно: "<query>:fetch"."""
+
+    def __init__(self, cursor: aiosqlite.Cursor, query: str):
+        self._cursor = cursor
+        self._query = query + ":fetch"
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    async def _timed(self, coro):
+        t0 = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            observer = _query_observer
+            if observer is not None:
+                observer(self._query, time.perf_counter() - t0)
+
+    async def fetchone(self):
+        return await self._timed(self._cursor.fetchone())
+
+    async def fetchall(self):
+        return await self._timed(self._cursor.fetchall())
+
+    async def fetchmany(self, size: Optional[int] = None):
+        return await self._timed(self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany())
+
+
+class _TimedConnection:
+    """
+    Обёртка соединения из пула: замеряет execute/executemany и передаёт
+    время в _query_observer с именем вызывающей функции. Пока наблюдатель
+    не задан, вызовы идут напрямую, без замеров.
+    """
+
+    def __init__(self, db: aiosqlite.Connection):
+        self._db = db
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._db, name)
+
+    async def execute(self, sql: str, *args: Any):
+        if _query_observer is None:
+            return await self._db.execute(sql, *args)
+        query = _caller_name(2)
+        t0 = time.perf_counter()
+        try:
+            cursor = await self._db.execute(sql, *args)
+        finally:
+            observer = _query_observer
+            if observer is not None:
+                observer(query, time.perf_counter() - t0)
+        return _TimedCursor(cursor, query)
+
+    async def executemany(self, sql: str, parameters: Any):
+        if _query_observer is None:
+            return await self._db.executemany(sql, parameters)
+        query = _caller_name(2)
+        t0 = time.perf_counter()
+        try:
+            return await self._db.executemany(sql, parameters)
+        finally:
+            observer = _query_observer
+            if observer is not None:
+                observer(query, time.perf_counter() - t0)
+
+
+class _Pool:
+    """
+    Долгоживущие соединения с БД: несколько читателей и один писатель.
+    Создаётся в init_db и закрывается в close_db, чтобы не открывать
+    новое соединение (и поток aiosqlite) на каждый запрос.
+
+    Все записи идут через очередь в единственную задачу-писателя, которая
+    забирает из очереди всё накопившееся и фиксирует пачку одним COMMIT
+    (group commit). Каждая запись выполняется в своём SAVEPOINT, так что
+    ошибка одной не откатывает соседние, а вызывающий получает свой результат
+    только после фиксации.
+    """
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self.readers: asyncio.Queue = asyncio.Queue()
+        self.writer: Optional[aiosqlite.Connection] = None
+        self.write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._all: List[aiosqlite.Connection] = []
+
+    async def _connect(self, **kwargs) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path, **kwargs)
+        db.row_factory = aiosqlite.Row
+        for sql in PRAGMA_SQL:
+            # часть PRAGMA возвращает строку; незакрытый курсор держит оператор активным
+            await (await db.execute(sql)).close()
+        self._all.append(db)
+        return _TimedConnection(db)
+
+    async def open(self):
+        # Писатель в autocommit-режиме: транзакциями управляем сами
+        self.writer = await self._connect(isolation_level=None)
+        # курсор обязательно закрыть: пока оператор активен, смена журнала держит
+        # блокировку файла и новые соединения получают "database is locked"
+        await (await self.writer.execute("PRAGMA journal_mode = WAL")).close()
+        for _ in range(self.readers_count):
+            self.readers.put_nowait(await self._connect())
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def close(self):
+        if self._writer_task is not None:
+            # None — сигнал остановки; всё, что уже в очереди, будет записано
+            await self.write_queue.put(None)
+            await self._writer_task
+            self._writer_task = None
+        if self.writer is not None:
+            # статистика планировщика (sqlite_stat1): SQLite сам делает ANALYZE
+            # таблиц, которым он нужен по запросам этого запуска
+            await (await self.writer.execute("PRAGMA optimize")).close()
+        for db in self._all:
+            await db.close()
+        self._all.clear()
+        self.writer = None
+
+    async def submit(self, job: WriteJob) -> Any:
+        fut = asyncio.get_running_loop().create_future()
+        await self.write_queue.put((job, fut))
+        return await fut
+
+    async def _writer_loop(self):
+        while True:
+            first = await self.write_queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stop = False
+            while len(batch) < WRITE_BATCH_MAX and not self.write_queue.empty():
+                item = self.write_queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._commit_batch(batch)
+            if stop:
+                return
+
+    async def _commit_batch(self, batch: List[Tuple[WriteJob, asyncio.Future]]):
+        db = self.writer
+        results = []
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for job, fut in batch:
+                if fut.cancelled():
+                    continue
+                await db.execute("SAVEPOINT job")
+                try:
+                    res = await job(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO job")
+                    await db.execute("RELEASE job")
+                    results.append((fut, None, e))
+                else:
+                    await db.execute("RELEASE job")
+                    results.append((fut, res, None))
+            await db.execute("COMMIT")
+        except Exception as e:
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for fut, res, err in results:
+            if fut.done():
+                continue
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+
+_pool: Optional[_Pool] = None
+_pool_lock = asyncio.Lock()
+
+
+async def _get_pool() -> _Pool:
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                pool = _Pool(DB_PATH, READER_POOL_SIZE)
+                await pool.open()
+                _pool = pool
+    return _pool
+
+
+@asynccontextmanager
+async def _read() -> AsyncIterator[aiosqlite.Connection]:
+    """Соединение-читатель из пула (возвращается в пул после использования)."""
+    pool = await _get_pool()
+    db = await pool.readers.get()
+    try:
+        yield db
+    finally:
+        pool.readers.put_nowait(db)
+
+
+async def _run_write(job: WriteJob) -> Any:
+    """
+    Выполнить запись через общую очередь писателя. job получает соединение
+    и не должен вызывать commit(): фиксацию делает писатель для всей пачки.
+    """
+    pool = await _get_pool()
+    return await pool.submit(job)
+
 
 # ---------------------- INIT ----------------------
 async def init_db(default_courier_fee_rub: int = 150):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("PRAGMA foreign_keys = ON;")
-        # Таблицы
-        for sql in CREATE_SQL:
-            await db.execute(sql)
-        # Миграции на случай старой БД
-        await _migrate_users_add_otp(db)
-        await _migrate_products_add_photo_sort(db)
-        # Индексы
-        for sql in INDEX_SQL:
-            await db.execute(sql)
-        # Значения по умолчанию
-        await db.execute(
-            "INSERT OR IGNORE INTO settings(key, value) VALUES('courier_fee_minor', ?)",
-            (default_courier_fee_rub * 100,)
-        )
-        # Служебная категория "Общее", если вдруг нет
-        await db.execute("INSERT OR IGNORE INTO categories(slug, title) VALUES('general','Общее')")
-        await db.commit()
+    async with _read() as db:
+        version = await _schema_version(db)
+    if version > SCHEMA_VERSION:
+        # БД обновлена более новой версией бота (например, при откате релиза)
+        print(f"[DB] Версия схемы {version} новее ожидаемой {SCHEMA_VERSION}, миграции пропущены")
+    elif version < SCHEMA_VERSION:
+        async def _job(db: aiosqlite.Connection):
+            # перечитываем под блокировкой записи: мог успеть другой процесс
+            current = await _schema_version(db)
+            for number, migrate in MIGRATIONS:
+                if number > current:
+                    await migrate(db)
+            if current < SCHEMA_VERSION:
+                # Значения по умолчанию
+                await db.execute(
+                    "INSERT OR IGNORE INTO settings(key, value) VALUES('courier_fee_minor', ?)",
+                    (default_courier_fee_rub * 100,)
+                )
+                # Служебная категория "Общее"
+                await db.execute("INSERT OR IGNORE INTO categories(slug, title) VALUES('general','Общее')")
+                # PRAGMA не принимает параметры; значение — наша константа
+                await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            return current
+        current = await _run_write(_job)
+        print(f"[DB] Схема обновлена: {current} -> {SCHEMA_VERSION}")
+    await _settings_ensure()
+
+async def close_db():
+    global _pool, _settings
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+    _catalog_invalidate()
+    _user_cache.clear()
+    _settings = None
 
 
 # ---------------------- SETTINGS ----------------------
+# Таблица settings целиком в памяти: читается один раз (в init_db),
+# db_set_setting пишет в БД и сразу обновляет копию (write-through).
+_settings: Optional[Dict[str, str]] = None
+_settings_lock = asyncio.Lock()
+
+
+async def _settings_ensure() -> Dict[str, str]:
+    global _settings
+    if _settings is None:
+        async with _settings_lock:
+            if _settings is None:
+                async with _read() as db:
+                    cur = await db.execute("SELECT key, value FROM settings")
+                    _settings = {r["key"]: r["value"] for r in await cur.fetchall()}
+    return _settings
+
 async def db_get_setting(key: str, default: Optional[str] = None) -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = await cur.fetchone()
-        return (row["value"] if row else (default or ""))
+    value = (await _settings_ensure()).get(key)
+    return value if value is not None else (default or "")
+
+async def db_get_setting_int(key: str, default: int) -> int:
+    value = (await _settings_ensure()).get(key)
+    try:
+        return int(value) if value is not None else default
+    except ValueError:
+        return default
+
+async def db_get_courier_fee_minor() -> int:
+    return await db_get_setting_int("courier_fee_minor", 15000)
 
 async def db_set_setting(key: str, value: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("INSERT OR REPLACE INTO settings(key, value) VALUES(?, ?)", (key, value))
-        await db.commit()
+    await _run_write(_job)
+    (await _settings_ensure())[key] = str(value)
 
 
 # ---------------------- USERS / OTP ----------------------
+USER_CACHE_TTL_SECONDS = 60.0
+USER_CACHE_MAX = 10000
+
+# tg_id -> (когда истекает, строка пользователя или None); сбрасывается записями в users
+_user_cache: Dict[int, Tuple[float, Optional[Dict[str, Any]]]] = {}
+
+
+def _user_cache_drop(tg_id: int):
+    _user_cache.pop(tg_id, None)
+
+
 async def db_get_user_by_tg(tg_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    now = time.monotonic()
+    cached = _user_cache.get(tg_id)
+    if cached is not None and cached[0] > now:
+        return dict(cached[1]) if cached[1] else None
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM users WHERE tg_id = ?", (tg_id,))
         row = await cur.fetchone()
-        return dict(row) if row else None
+        user = dict(row) if row else None
+    if len(_user_cache) >= USER_CACHE_MAX:
+        # самая старая запись (dict хранит порядок вставки)
+        _user_cache.pop(next(iter(_user_cache)))
+    _user_cache.pop(tg_id, None)
+    _user_cache[tg_id] = (now + USER_CACHE_TTL_SECONDS, user)
+    return dict(user) if user else None
 
 async def db_create_or_update_user_base(tg_id: int, name: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("""
             INSERT INTO users(tg_id, name, phone, is_verified)
             VALUES(?, ?, '', 0)
             ON CONFLICT(tg_id) DO UPDATE SET name=excluded.name
         """, (tg_id, name))
-        await db.commit()
+    await _run_write(_job)
+    _user_cache_drop(tg_id)
 
-async def db_set_user_phone_and_otp(tg_id: int, phone: str, otp_code_hash: str, expires_iso: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+async def db_set_user_phone_verified(tg_id: int, phone: str):
+    """Сохранить подтверждённый телефон (сам код подтверждения живёт в app.otp, не в БД)."""
+    async def _job(db: aiosqlite.Connection):
         await db.execute("""
             UPDATE users
-               SET phone = ?, otp_code_hash = ?, otp_expires_at = ?, is_verified = 0
+               SET phone = ?, is_verified = 1, otp_code_hash = NULL, otp_expires_at = NULL
              WHERE tg_id = ?
-        """, (phone, otp_code_hash, expires_iso, tg_id))
-        await db.commit()
-
-async def db_mark_user_verified(tg_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            UPDATE users
-               SET is_verified = 1, otp_code_hash = NULL, otp_expires_at = NULL
-             WHERE tg_id = ?
-        """, (tg_id,))
-        await db.commit()
+        """, (phone, tg_id))
+    await _run_write(_job)
+    _user_cache_drop(tg_id)
 
 
 # ---------------------- ADDRESSES ----------------------
 async def db_get_default_address(user_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("""
             SELECT * FROM addresses
              WHERE user_id = ? AND is_default = 1
@@ -209,7 +801,7 @@ async def db_get_default_address(user_id: int) -> Optional[Dict[str, Any]]:
         return dict(row) if row else None
 
 async def db_set_default_address(user_id: int, addr: Dict[str, Any]):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("""
             INSERT INTO addresses(user_id, address_line, apt, entrance, floor, comment, is_default)
             VALUES(?, ?, ?, ?, ?, ?, 1)
@@ -221,100 +813,298 @@ async def db_set_default_address(user_id: int, addr: Dict[str, Any]):
             addr.get("floor"),
             addr.get("comment"),
         ))
-        await db.commit()
+    await _run_write(_job)
 
 
 # ---------------------- CATEGORIES ----------------------
 async def db_list_categories() -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT id, slug, title FROM categories ORDER BY id ASC")
         rows = await cur.fetchall()
         return [dict(r) for r in rows]
 
 async def db_get_category(cat_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT id, slug, title FROM categories WHERE id = ?", (cat_id,))
         row = await cur.fetchone()
         return dict(row) if row else None
 
 async def db_create_category(title: str, slug: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("INSERT INTO categories(slug, title) VALUES(?, ?)", (slug, title))
-        await db.commit()
         cur = await db.execute("SELECT last_insert_rowid()")
         rid = await cur.fetchone()
         return int(rid[0])
+    return await _run_write(_job)
 
 async def db_update_category_title(cat_id: int, title: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE categories SET title = ? WHERE id = ?", (title, cat_id))
-        await db.commit()
+    await _run_write(_job)
+
+GENERAL_CATEGORY_SLUG = "general"
+
+async def db_get_or_create_general_category_id() -> int:
+    """Служебная категория для товаров, добавленных из админки."""
+    async with _read() as db:
+        cur = await db.execute("SELECT id FROM categories WHERE slug = ?", (GENERAL_CATEGORY_SLUG,))
+        row = await cur.fetchone()
+    if row:
+        return int(row[0])
+
+    async def _job(db: aiosqlite.Connection):
+        await db.execute(
+            "INSERT OR IGNORE INTO categories(slug, title) VALUES(?, ?)", (GENERAL_CATEGORY_SLUG, "Общее")
+        )
+        cur = await db.execute("SELECT id FROM categories WHERE slug = ?", (GENERAL_CATEGORY_SLUG,))
+        return int((await cur.fetchone())[0])
+    return await _run_write(_job)
 
 async def db_count_products_in_category(cat_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _read() as db:
         cur = await db.execute("SELECT COUNT(*) FROM products WHERE category_id = ?", (cat_id,))
         cnt = await cur.fetchone()
         return int(cnt[0] if cnt else 0)
 
 async def db_delete_category(cat_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
-        await db.commit()
+    await _run_write(_job)
+
+
+# ---------------------- CATALOG CACHE ----------------------
+# Курсор страницы: (направление, sort_order, id).
+#   "n" — строго после товара, "p" — строго до товара, "a" — начиная с товара.
+Cursor = Tuple[str, int, int]
+# Страница: (товары, всего товаров, есть ли предыдущая, есть ли следующая)
+ProductPage = Tuple[List[Dict[str, Any]], int, bool, bool]
+
+
+def _sort_key(p: Dict[str, Any]) -> Tuple[int, int]:
+    # Порядок витрины: sort_order ASC, id DESC
+    return (int(p["sort_order"]), -int(p["id"]))
+
+
+# Сколько нарезанных страниц храним: курсор приходит из callback_data, и
+# подделанные курсоры не должны раздувать кэш
+CATALOG_PAGES_MAX = 1024
+
+
+class _CatalogCache:
+    """
+    Кэш каталога в памяти процесса: товары по id и sku, упорядоченный
+    публичный список и уже нарезанные страницы. Заполняется при первом
+    обращении и сбрасывается любой записью в products (версия растёт).
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.by_id: Optional[Dict[int, Dict[str, Any]]] = None
+        self.by_sku: Dict[str, Dict[str, Any]] = {}
+        self.public: List[Dict[str, Any]] = []
+        # Ключи сортировки публичного списка (по категориям) для поиска курсора бинарным поиском
+        self.listings: Dict[Optional[int], Tuple[List[Dict[str, Any]], List[Tuple[int, int]]]] = {}
+        # LRU: последние CATALOG_PAGES_MAX страниц
+        self.pages: "OrderedDict[Tuple[Optional[Cursor], int, Optional[int]], ProductPage]" = OrderedDict()
+        self.totals: Dict[Optional[int], int] = {}
+        self.lock = asyncio.Lock()
+
+    def listing(self, category_id: Optional[int]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, int]]]:
+        found = self.listings.get(category_id)
+        if found is None:
+            rows = self.public
+            if category_id:
+                rows = [p for p in rows if p["category_id"] == category_id]
+            found = (rows, [_sort_key(p) for p in rows])
+            self.listings[category_id] = found
+        return found
+
+
+_catalog = _CatalogCache()
+
+
+def catalog_version() -> int:
+    """Текущая версия каталога; меняется при каждом изменении товаров."""
+    return _catalog.version
+
+
+def _catalog_invalidate():
+    _catalog.version += 1
+    _catalog.by_id = None
+    _catalog.by_sku = {}
+    _catalog.public = []
+    _catalog.listings = {}
+    _catalog.pages.clear()
+    _catalog.totals.clear()
+
+
+async def _catalog_ensure() -> _CatalogCache:
+    if _catalog.by_id is not None:
+        return _catalog
+    async with _catalog.lock:
+        if _catalog.by_id is not None:
+            return _catalog
+        version = _catalog.version
+        async with _read() as db:
+            cur = await db.execute("SELECT * FROM products ORDER BY sort_order ASC, id DESC")
+            rows = [dict(r) for r in await cur.fetchall()]
+        if version == _catalog.version:
+            _catalog.by_id = {int(r["id"]): r for r in rows}
+            _catalog.by_sku = {r["sku"]: r for r in rows}
+            _catalog.public = [r for r in rows if r["available"]]
+    return _catalog
 
 
 # ---------------------- PRODUCTS ----------------------
-async def db_list_products_public(
-    page: int,
+def _slice_page(
+    rows: List[Dict[str, Any]],
+    keys: List[Tuple[int, int]],
+    cursor: Optional[Cursor],
+    page_size: int
+) -> ProductPage:
+    total = len(rows)
+    start = 0
+    if cursor:
+        direction, sort_order, prod_id = cursor
+        key = (sort_order, -prod_id)
+        if direction == "n":
+            start = bisect_right(keys, key)
+        elif direction == "a":
+            start = bisect_left(keys, key)
+        elif direction == "p":
+            start = max(0, bisect_left(keys, key) - page_size)
+    if start >= total:
+        # курсор указывает за конец списка (товары удалили) — показываем последнюю страницу
+        start = max(0, total - page_size)
+    items = rows[start:start + page_size]
+    return [dict(p) for p in items], total, start > 0, start + len(items) < total
+
+
+async def _db_count_products_public(category_id: Optional[int]) -> int:
+    version = _catalog.version
+    total = _catalog.totals.get(category_id)
+    if total is not None:
+        return total
+    sql = "SELECT COUNT(*) FROM products WHERE available = 1"
+    params: List[Any] = []
+    if category_id:
+        sql += " AND category_id = ?"
+        params.append(category_id)
+    async with _read() as db:
+        cur = await db.execute(sql, params)
+        total = int((await cur.fetchone())[0])
+    if version == _catalog.version:
+        _catalog.totals[category_id] = total
+    return total
+
+
+async def _db_list_products_keyset(
+    cursor: Optional[Cursor],
     page_size: int,
-    search: Optional[str] = None,
-    category_id: Optional[int] = None
-) -> Tuple[List[Dict[str, Any]], int]:
+    category_id: Optional[int]
+) -> ProductPage:
     """
-    Список товаров для пользователей (available=1) с пагинацией, опционально: поиск и фильтр по категории.
-    Сортировка: sort_order ASC, id DESC.
+    Keyset-пагинация в БД (когда кэш каталога недоступен):
+    стоимость страницы не зависит от её глубины.
     """
-    offset = max(0, (page - 1) * max(1, page_size))
     where = ["available = 1"]
     params: List[Any] = []
     if category_id:
         where.append("category_id = ?")
         params.append(category_id)
-    like = None
-    if search:
-        like = f"%{search.strip()}%"
-        where.append("(title LIKE ? OR sku LIKE ?)")
-        params.extend([like, like])
-
-    where_sql = " AND ".join(where)
-    sql_items = f"""
-        SELECT id, sku, title, price_minor, available, photo_file_id, sort_order
+    direction = cursor[0] if cursor else None
+    if cursor:
+        _, sort_order, prod_id = cursor
+        if direction == "p":
+            where.append("(sort_order < ? OR (sort_order = ? AND id > ?))")
+        elif direction == "a":
+            where.append("(sort_order > ? OR (sort_order = ? AND id <= ?))")
+        else:
+            where.append("(sort_order > ? OR (sort_order = ? AND id < ?))")
+        params.extend([sort_order, sort_order, prod_id])
+    order = "sort_order DESC, id ASC" if direction == "p" else "sort_order ASC, id DESC"
+    sql = f"""
+        SELECT id, category_id, sku, title, price_minor, available, photo_file_id, sort_order
           FROM products
-         WHERE {where_sql}
-         ORDER BY sort_order ASC, id DESC
-         LIMIT ? OFFSET ?
+         WHERE {" AND ".join(where)}
+         ORDER BY {order}
+         LIMIT ?
     """
-    sql_count = f"SELECT COUNT(*) AS cnt FROM products WHERE {where_sql}"
+    async with _read() as db:
+        cur = await db.execute(sql, params + [page_size + 1])
+        rows = [dict(r) for r in await cur.fetchall()]
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    total = await _db_count_products_public(category_id)
+    if direction == "p":
+        rows.reverse()
+        if not rows:
+            return await _db_list_products_keyset(None, page_size, category_id)
+        return rows, total, more, True
+    return rows, total, cursor is not None, more
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
 
-        # total
-        cur = await db.execute(sql_count, params)
-        total = (await cur.fetchone())["cnt"]
+async def db_list_products_public(
+    page_size: int,
+    cursor: Optional[Cursor] = None,
+    category_id: Optional[int] = None
+) -> ProductPage:
+    """
+    Страница товаров для пользователей (available=1), опционально с фильтром по категории.
+    Сортировка: sort_order ASC, id DESC. Пагинация по курсору (см. Cursor), без OFFSET и COUNT.
+    Отдаётся из кэша каталога, не обращаясь к БД.
+    """
+    cache = await _catalog_ensure()
+    if cache.by_id is None:
+        return await _db_list_products_keyset(cursor, page_size, category_id)
+    key = (cursor, page_size, category_id)
+    page = cache.pages.get(key)
+    if page is None:
+        rows, keys = cache.listing(category_id)
+        page = _slice_page(rows, keys, cursor, page_size)
+        cache.pages[key] = page
+        if len(cache.pages) > CATALOG_PAGES_MAX:
+            cache.pages.popitem(last=False)
+    else:
+        cache.pages.move_to_end(key)
+    items, total, has_prev, has_next = page
+    return [dict(p) for p in items], total, has_prev, has_next
 
-        # items
-        cur2 = await db.execute(sql_items, params + [page_size, offset])
-        rows = await cur2.fetchall()
-        return [dict(r) for r in rows], int(total)
+def _fts_query(text: str) -> str:
+    """Пользовательский ввод -> запрос FTS5: каждое слово как префикс, все слова обязательны."""
+    words = re.findall(r"\w+", text or "")
+    return " ".join(f'"{w}"*' for w in words)
 
 async def db_search_products_public(query: str, page: int, page_size: int) -> Tuple[List[Dict[str, Any]], int]:
-    return await db_list_products_public(page=page, page_size=page_size, search=query)
+    """
+    Поиск доступных товаров по названию и SKU через FTS5 (без учёта регистра, по началу слов).
+    Результаты упорядочены по релевантности.
+    """
+    match = _fts_query(query)
+    if not match:
+        return [], 0
+    offset = max(0, (page - 1) * max(1, page_size))
+    async with _read() as db:
+        cur = await db.execute("""
+            SELECT COUNT(*) AS cnt
+              FROM products_fts f
+              JOIN products p ON p.id = f.rowid
+             WHERE products_fts MATCH ? AND p.available = 1
+        """, (match,))
+        total = (await cur.fetchone())["cnt"]
+        cur2 = await db.execute("""
+            SELECT p.id, p.sku, p.title, p.price_minor, p.available, p.photo_file_id, p.sort_order
+              FROM products_fts f
+              JOIN products p ON p.id = f.rowid
+             WHERE products_fts MATCH ? AND p.available = 1
+             ORDER BY f.rank
+             LIMIT ? OFFSET ?
+        """, (match, page_size, offset))
+        rows = await cur2.fetchall()
+        return [dict(r) for r in rows], int(total)
 
 async def db_list_products_by_category_admin(cat_id: int) -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("""
             SELECT p.id, p.sku, p.title, p.price_minor, p.available, p.photo_file_id, p.sort_order,
                    c.title AS category_title
@@ -327,8 +1117,7 @@ async def db_list_products_by_category_admin(cat_id: int) -> List[Dict[str, Any]
         return [dict(r) for r in rows]
 
 async def db_list_products_admin(limit: int = 50) -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("""
             SELECT p.id, p.sku, p.title, p.price_minor, p.available, p.photo_file_id, p.sort_order
               FROM products p
@@ -339,15 +1128,21 @@ async def db_list_products_admin(limit: int = 50) -> List[Dict[str, Any]]:
         return [dict(r) for r in rows]
 
 async def db_get_product(prod_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    cache = await _catalog_ensure()
+    if cache.by_id is not None:
+        row = cache.by_id.get(int(prod_id))
+        return dict(row) if row else None
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM products WHERE id = ?", (prod_id,))
         row = await cur.fetchone()
         return dict(row) if row else None
 
 async def db_find_product_by_sku(sku: str) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    cache = await _catalog_ensure()
+    if cache.by_id is not None:
+        row = cache.by_sku.get(sku)
+        return dict(row) if row else None
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM products WHERE sku = ?", (sku,))
         row = await cur.fetchone()
         return dict(row) if row else None
@@ -361,35 +1156,41 @@ async def db_create_product(
     photo_file_id: Optional[str] = None,
     sort_order: int = 0
 ) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("""
             INSERT INTO products(category_id, sku, title, price_minor, available, photo_file_id, sort_order)
             VALUES(?,?,?,?,?,?,?)
         """, (cat_id, sku, title, price_minor, available, photo_file_id, sort_order))
-        await db.commit()
         cur = await db.execute("SELECT last_insert_rowid()")
         rid = await cur.fetchone()
         return int(rid[0])
+    rid = await _run_write(_job)
+    _catalog_invalidate()
+    return rid
 
 async def db_update_product_title(prod_id: int, title: str):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE products SET title = ? WHERE id = ?", (title, prod_id))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
 
 async def db_update_product_price(prod_id: int, price_minor: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE products SET price_minor = ? WHERE id = ?", (price_minor, prod_id))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
 
 async def db_set_product_available(prod_id: int, available: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE products SET available = ? WHERE id = ?", (available, prod_id))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
 
 async def db_update_product_photo(prod_id: int, photo_file_id: Optional[str]):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE products SET photo_file_id = ? WHERE id = ?", (photo_file_id, prod_id))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
 
 async def db_update_product_sku(prod_id: int, new_sku: str) -> bool:
     """
@@ -399,125 +1200,438 @@ async def db_update_product_sku(prod_id: int, new_sku: str) -> bool:
     exists = await db_find_product_by_sku(new_sku)
     if exists and int(exists["id"]) != int(prod_id):
         return False
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE products SET sku = ? WHERE id = ?", (new_sku, prod_id))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
     return True
 
 async def db_update_product_sort_order(prod_id: int, sort_order: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("UPDATE products SET sort_order = ? WHERE id = ?", (sort_order, prod_id))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
 
 async def db_delete_product(prod_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("DELETE FROM products WHERE id = ?", (prod_id,))
-        await db.commit()
+    await _run_write(_job)
+    _catalog_invalidate()
+
+async def db_import_products(items: List[Dict[str, Any]], deactivate_missing: bool = True) -> Dict[str, int]:
+    """
+    Массовый импорт каталога. items — {"sku", "title", "price_minor", "available",
+    "sort_order", "category_slug", "category_title"}. Сравнивает с текущими товарами
+    по sku и одной транзакцией добавляет новые, обновляет изменившиеся и (если
+    deactivate_missing) скрывает товары из прежних выгрузок, которых нет в этой;
+    товары, заведённые администратором вручную, не скрываются. Фото и id
+    существующих товаров не трогаются. Возвращает счётчики.
+    """
+    async def _job(db: aiosqlite.Connection):
+        categories = {it["category_slug"]: it["category_title"] for it in items}
+        await db.executemany("""
+            INSERT INTO categories(slug, title) VALUES(?, ?)
+            ON CONFLICT(slug) DO UPDATE SET title = excluded.title WHERE title != excluded.title
+        """, list(categories.items()))
+        cur = await db.execute("SELECT id, slug FROM categories")
+        cat_ids = {r["slug"]: int(r["id"]) for r in await cur.fetchall()}
+
+        cur = await db.execute(
+            "SELECT id, sku, category_id, title, price_minor, available, sort_order, from_feed FROM products"
+        )
+        existing = {r["sku"]: r for r in await cur.fetchall()}
+
+        inserts, updates = [], []
+        for it in items:
+            row = (cat_ids[it["category_slug"]], it["title"], it["price_minor"], it["available"], it["sort_order"])
+            old = existing.get(it["sku"])
+            if old is None:
+                inserts.append((*row, it["sku"]))
+            elif row != (old["category_id"], old["title"], old["price_minor"], old["available"], old["sort_order"]) \
+                    or not old["from_feed"]:
+                updates.append((*row, old["id"]))
+        seen = {it["sku"] for it in items}
+        deactivate = [
+            (r["id"],) for sku, r in existing.items()
+            if deactivate_missing and r["from_feed"] and r["available"] and sku not in seen
+        ]
+
+        if inserts:
+            await db.executemany("""
+                INSERT INTO products(category_id, title, price_minor, available, sort_order, sku, from_feed)
+                VALUES(?,?,?,?,?,?,1)
+            """, inserts)
+        if updates:
+            await db.executemany("""
+                UPDATE products SET category_id = ?, title = ?, price_minor = ?, available = ?, sort_order = ?,
+                                    from_feed = 1
+                 WHERE id = ?
+            """, updates)
+        if deactivate:
+            await db.executemany("UPDATE products SET available = 0 WHERE id = ?", deactivate)
+        return {
+            "added": len(inserts),
+            "updated": len(updates),
+            "deactivated": len(deactivate),
+            "unchanged": len(items) - len(inserts) - len(updates),
+        }
+    result = await _run_write(_job)
+    if result["added"] or result["updated"] or result["deactivated"]:
+        _catalog_invalidate()
+    return result
 
 
 # ---------------------- CART / ORDERS ----------------------
+async def _get_or_create_cart(db: aiosqlite.Connection, user_id: int) -> int:
+    cur = await db.execute("SELECT id FROM orders WHERE user_id = ? AND status = 'cart'", (user_id,))
+    row = await cur.fetchone()
+    if row:
+        return int(row["id"])
+    created_at = datetime.utcnow().isoformat()
+    cur2 = await db.execute("""
+        INSERT INTO orders(user_id, status, created_at, subtotal_minor, delivery_fee_minor, total_minor)
+        VALUES(?, 'cart', ?, 0, 0, 0)
+    """, (user_id, created_at))
+    return int(cur2.lastrowid)
+
+async def _add_cart_line(db: aiosqlite.Connection, order_id: int, sku: str, title: str, unit_price_minor: int):
+    await db.execute("""
+        INSERT INTO order_items(order_id, sku, title, unit_price_minor, qty)
+        VALUES(?, ?, ?, ?, 1)
+        ON CONFLICT(order_id, sku) DO UPDATE SET qty = qty + 1
+    """, (order_id, sku, title, unit_price_minor))
+
 async def db_get_or_create_cart(user_id: int) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("""
-            SELECT id FROM orders
-             WHERE user_id = ? AND status = 'cart'
-             ORDER BY id DESC LIMIT 1
-        """, (user_id,))
+    # корзина обычно уже есть — ищем её читателем; в очередь писателя
+    # встаём только чтобы создать (там поиск повторяется под блокировкой)
+    async with _read() as db:
+        cur = await db.execute("SELECT id FROM orders WHERE user_id = ? AND status = 'cart'", (user_id,))
         row = await cur.fetchone()
-        if row:
-            return int(row["id"])
-        created_at = datetime.utcnow().isoformat()
-        await db.execute("""
-            INSERT INTO orders(user_id, status, created_at, subtotal_minor, delivery_fee_minor, total_minor)
-            VALUES(?, 'cart', ?, 0, 0, 0)
-        """, (user_id, created_at))
-        await db.commit()
-        cur2 = await db.execute("SELECT last_insert_rowid() AS id")
-        rid = await cur2.fetchone()
-        return int(rid["id"])
+    if row:
+        return int(row["id"])
+
+    async def _job(db: aiosqlite.Connection):
+        return await _get_or_create_cart(db, user_id)
+    return await _run_write(_job)
 
 async def db_add_item_to_cart(order_id: int, sku: str, title: str, unit_price_minor: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("""
-            SELECT id, qty FROM order_items
-             WHERE order_id = ? AND sku = ?
-        """, (order_id, sku))
-        row = await cur.fetchone()
-        if row:
-            await db.execute("UPDATE order_items SET qty = ? WHERE id = ?", (int(row["qty"]) + 1, row["id"]))
-        else:
-            await db.execute("""
-                INSERT INTO order_items(order_id, sku, title, unit_price_minor, qty)
-                VALUES(?, ?, ?, ?, 1)
-            """, (order_id, sku, title, unit_price_minor))
-        await db.commit()
+    async def _job(db: aiosqlite.Connection):
+        await _add_cart_line(db, order_id, sku, title, unit_price_minor)
+    await _run_write(_job)
+
+async def db_cart_add_product(tg_id: int, product: Dict[str, Any]) -> Optional[int]:
+    """
+    Добавить товар в корзину одной транзакцией: найти пользователя, найти или создать
+    корзину и увеличить количество (upsert по (order_id, sku)); суммы корзины
+    пересчитывают триггеры. Возвращает id корзины или None, если пользователь
+    не зарегистрирован.
+    """
+    async def _job(db: aiosqlite.Connection):
+        cur = await db.execute("SELECT id FROM users WHERE tg_id = ?", (tg_id,))
+        user = await cur.fetchone()
+        if not user:
+            return None
+        order_id = await _get_or_create_cart(db, int(user["id"]))
+        await _add_cart_line(db, order_id, product["sku"], product["title"], product["price_minor"])
+        # корзина изменилась — способ доставки выбирается заново
+        await db.execute(
+            "UPDATE orders SET delivery_fee_minor = 0 WHERE id = ? AND delivery_fee_minor != 0", (order_id,)
+        )
+        return order_id
+    return await _run_write(_job)
 
 async def db_get_cart_items(order_id: int) -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM order_items WHERE order_id = ?", (order_id,))
         rows = await cur.fetchall()
         return [dict(r) for r in rows]
 
-async def db_update_order_totals(order_id: int, delivery_fee_minor: int = 0):
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT unit_price_minor, qty FROM order_items WHERE order_id = ?", (order_id,))
-        items = await cur.fetchall()
-        subtotal = sum(int(x["unit_price_minor"]) * int(x["qty"]) for x in items)
-        total = subtotal + int(delivery_fee_minor)
-        await db.execute("""
-            UPDATE orders
-               SET subtotal_minor = ?, delivery_fee_minor = ?, total_minor = ?
-             WHERE id = ?
-        """, (subtotal, delivery_fee_minor, total, order_id))
-        await db.commit()
+async def db_set_order_delivery_fee(order_id: int, delivery_fee_minor: int = 0):
+    """Стоимость доставки заказа; total_minor пересчитывает триггер."""
+    async def _job(db: aiosqlite.Connection):
+        await db.execute("UPDATE orders SET delivery_fee_minor = ? WHERE id = ?", (int(delivery_fee_minor), order_id))
+    await _run_write(_job)
 
 async def db_set_order_checkout(order_id: int, delivery_type: str, address_snapshot: Optional[Dict[str, Any]]):
-    async with aiosqlite.connect(DB_PATH) as db:
+    # строку адреса собираем один раз здесь, а не при каждом просмотре в админке
+    address_text = format_address(address_snapshot) if address_snapshot else None
+
+    async def _job(db: aiosqlite.Connection):
         await db.execute("""
             UPDATE orders
                SET status = 'confirming',
                    delivery_type = ?,
-                   address_snapshot = ?
+                   address_snapshot = ?,
+                   address_text = ?,
+                   checked_out_at = ?
              WHERE id = ?
-        """, (delivery_type, json.dumps(address_snapshot or {}, ensure_ascii=False), order_id))
-        await db.commit()
+        """, (
+            delivery_type, json.dumps(address_snapshot or {}, ensure_ascii=False), address_text,
+            datetime.utcnow().isoformat(), order_id,
+        ))
+    await _run_write(_job)
 
 async def db_get_order_basic(order_id: int) -> Optional[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cur = await db.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
         row = await cur.fetchone()
         return dict(row) if row else None
 
 async def db_get_user_active_orders(limit: int = 20) -> List[Dict[str, Any]]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         # Вытаскиваем активные заказы + контакт пользователя
-        cur = await db.execute("""
+        cur = await db.execute(f"""
             SELECT o.*, u.name, u.phone, u.tg_id
               FROM orders o
               JOIN users u ON u.id = o.user_id
-             WHERE o.status IN ('confirming','preparing','delivering')
+             WHERE unlikely(o.status IN ({ACTIVE_ORDER_STATUSES_SQL}))
              ORDER BY o.id DESC
              LIMIT ?
         """, (limit,))
         rows = await cur.fetchall()
         return [dict(r) for r in rows]
 
-async def db_set_order_status(order_id: int, status: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE orders SET status = ? WHERE id = ?", (status, order_id))
-        await db.commit()
+# Курсор доски заказов: ("n", id) — заказы старше id, ("p", id) — новее id
+OrderCursor = Tuple[str, int]
+
+async def db_list_orders_board(
+    status: Optional[str], page_size: int, cursor: Optional[OrderCursor] = None
+) -> Tuple[List[Dict[str, Any]], bool, bool]:
+    """
+    Страница доски заказов (новые сверху) по статусу; status=None — все активные.
+    Keyset по id через индекс, без сортировки. Возвращает (заказы, есть новее, есть старше).
+    """
+    if status:
+        # один статус — индекс (status, id); все активные — частичный idx_orders_active
+        statuses: Tuple[str, ...] = (status,)
+        marks = "?"
+    else:
+        statuses, marks = (), ACTIVE_ORDER_STATUSES_SQL
+    direction, cid = cursor if cursor else ("n", None)
+    if direction == "p":
+        cond, order = "AND o.id > ?", "ASC"
+    else:
+        cond, order = ("AND o.id < ?" if cid is not None else ""), "DESC"
+    params: List[Any] = list(statuses) + ([cid] if cid is not None else []) + [page_size + 1]
+    async with _read() as db:
+        cur = await db.execute(f"""
+            SELECT o.id, o.status, o.total_minor, o.delivery_type, o.address_text, o.created_at,
+                   u.name, u.phone, u.tg_id
+              FROM orders o
+              LEFT JOIN users u ON u.id = o.user_id
+             WHERE unlikely(o.status IN ({marks})) {cond}
+             ORDER BY o.id {order}
+             LIMIT ?
+        """, params)
+        rows = [dict(r) for r in await cur.fetchall()]
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if direction == "p":
+            rows.reverse()
+        if not rows:
+            return [], False, False
+        # с другой стороны страницы достаточно проверить существование
+        other_sql = f"SELECT 1 FROM orders WHERE unlikely(status IN ({marks})) AND id {{}} ? LIMIT 1"
+        if direction == "p":
+            has_prev = more
+            cur = await db.execute(other_sql.format("<"), (*statuses, rows[-1]["id"]))
+            has_next = await cur.fetchone() is not None
+        else:
+            has_next = more
+            has_prev = False
+            if cid is not None:
+                cur = await db.execute(other_sql.format(">"), (*statuses, rows[0]["id"]))
+                has_prev = await cur.fetchone() is not None
+    return rows, has_prev, has_next
+
+async def db_count_orders_by_status(statuses: Tuple[str, ...] = ACTIVE_ORDER_STATUSES) -> Dict[str, int]:
+    """Число заказов в каждом статусе (по индексу (status, id), без чтения строк)."""
+    marks = ",".join("?" * len(statuses))
+    async with _read() as db:
+        cur = await db.execute(
+            f"SELECT status, COUNT(*) AS n FROM orders WHERE status IN ({marks}) GROUP BY status", statuses
+        )
+        counts = {r["status"]: r["n"] for r in await cur.fetchall()}
+    return {s: counts.get(s, 0) for s in statuses}
+
+async def db_set_orders_status(order_ids: List[int], status: str) -> List[Tuple[int, Optional[int]]]:
+    """
+    Сменить статус нескольких заказов одной транзакцией. Корзины и заказы,
+    уже стоящие в этом статусе, не трогаются. Возвращает (order_id, tg_id)
+    действительно изменённых заказов — кому отправить уведомление.
+    """
+    ids = list(dict.fromkeys(order_ids))
+
+    async def _job(db: aiosqlite.Connection):
+        changed: List[Tuple[int, Optional[int]]] = []
+        old_status: Dict[int, str] = {}
+        for i in range(0, len(ids), 500):  # не упираемся в лимит параметров SQLite
+            chunk = ids[i:i + 500]
+            cur = await db.execute(f"""
+                SELECT o.id, o.status, u.tg_id
+                  FROM orders o
+                  LEFT JOIN users u ON u.id = o.user_id
+                 WHERE o.id IN ({",".join("?" * len(chunk))})
+                   AND o.status NOT IN ('cart', ?)
+            """, (*chunk, status))
+            for r in await cur.fetchall():
+                changed.append((r["id"], r["tg_id"]))
+                old_status[r["id"]] = r["status"]
+        if changed:
+            await db.executemany(
+                "UPDATE orders SET status = ? WHERE id = ?", [(status, oid) for oid, _ in changed]
+            )
+            # агрегаты продаж: заказ входит в завершённый статус (+) или выходит из него (−)
+            for kind in SALES_STATUSES:
+                if status == kind:
+                    await _sales_apply_ids(db, list(old_status), +1, kind)
+                else:
+                    await _sales_apply_ids(db, [oid for oid, old in old_status.items() if old == kind], -1, kind)
+        return changed
+    return await _run_write(_job)
+
+async def db_set_order_status(order_id: int, status: str) -> bool:
+    """Сменить статус одного заказа; False — заказа нет, это корзина или статус тот же."""
+    return bool(await db_set_orders_status([order_id], status))
 
 async def db_clear_cart(order_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async def _job(db: aiosqlite.Connection):
         await db.execute("DELETE FROM order_items WHERE order_id = ?", (order_id,))
-        await db.execute("""
-            UPDATE orders SET subtotal_minor = 0, delivery_fee_minor = 0, total_minor = 0
-             WHERE id = ?
-        """, (order_id,))
-        await db.commit()
+        await db.execute("UPDATE orders SET delivery_fee_minor = 0 WHERE id = ?", (order_id,))
+    await _run_write(_job)
+
+
+# ---------------------- FSM STATES ----------------------
+async def db_fsm_get(key: str) -> Optional[Dict[str, Any]]:
+    async with _read() as db:
+        cur = await db.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,))
+        row = await cur.fetchone()
+        return dict(row) if row else None
+
+async def db_fsm_flush(upserts: List[Tuple[str, Optional[str], str, float]], deletes: List[str]):
+    """
+    Записать пачку накопленных изменений одной транзакцией.
+    upserts: (key, state, data_json, updated_at); deletes: ключи пустых состояний.
+    """
+    async def _job(db: aiosqlite.Connection):
+        if upserts:
+            await db.executemany("""
+                INSERT INTO fsm_states(key, state, data, updated_at) VALUES(?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """, upserts)
+        if deletes:
+            await db.executemany("DELETE FROM fsm_states WHERE key = ?", [(k,) for k in deletes])
+    await _run_write(_job)
+
+async def db_fsm_purge(older_than: float) -> int:
+    """Удалить брошенные состояния (последнее изменение раньше older_than, unix time)."""
+    async def _job(db: aiosqlite.Connection):
+        cur = await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (older_than,))
+        return cur.rowcount
+    return await _run_write(_job)
+
+
+# ---------------------- SALES AGGREGATES ----------------------
+SALES_STATUSES = ("delivered", "canceled")
+
+
+def _sales_shift() -> str:
+    return f"{REPORT_UTC_OFFSET_HOURS:+d} hours"
+
+async def _sales_apply(db: aiosqlite.Connection, where: str, params: Tuple[Any, ...], sign: int, kind: str):
+    """
+    Прибавить (sign=+1) или вычесть (-1) заказы orders o WHERE <where> из агрегатов.
+    Заказ попадает в час/день оформления; без него (статус сменили прямо из корзины) — создания.
+    """
+    shift = _sales_shift()
+    for table, col, fmt in (("sales_hourly", "hour", "%Y-%m-%dT%H"), ("sales_daily", "day", "%Y-%m-%d")):
+        if kind == "delivered":
+            await db.execute(f"""
+                INSERT INTO {table}({col}, delivered_orders, revenue_minor, delivery_fee_minor, pickup_orders, courier_orders)
+                SELECT strftime('{fmt}', COALESCE(o.checked_out_at, o.created_at), ?) AS b,
+                       ? * COUNT(*), ? * SUM(o.total_minor), ? * SUM(o.delivery_fee_minor),
+                       ? * SUM(o.delivery_type = 'pickup'), ? * SUM(o.delivery_type = 'courier')
+                  FROM orders o
+                 WHERE {where}
+                 GROUP BY b
+                ON CONFLICT({col}) DO UPDATE SET
+                    delivered_orders = delivered_orders + excluded.delivered_orders,
+                    revenue_minor = revenue_minor + excluded.revenue_minor,
+                    delivery_fee_minor = delivery_fee_minor + excluded.delivery_fee_minor,
+                    pickup_orders = pickup_orders + excluded.pickup_orders,
+                    courier_orders = courier_orders + excluded.courier_orders
+            """, (shift, sign, sign, sign, sign, sign, *params))
+        else:
+            await db.execute(f"""
+                INSERT INTO {table}({col}, canceled_orders)
+                SELECT strftime('{fmt}', COALESCE(o.checked_out_at, o.created_at), ?) AS b, ? * COUNT(*)
+                  FROM orders o
+                 WHERE {where}
+                 GROUP BY b
+                ON CONFLICT({col}) DO UPDATE SET canceled_orders = canceled_orders + excluded.canceled_orders
+            """, (shift, sign, *params))
+    if kind == "delivered":
+        await db.execute(f"""
+            INSERT INTO sales_sku_daily(day, sku, title, units, revenue_minor)
+            SELECT strftime('%Y-%m-%d', COALESCE(o.checked_out_at, o.created_at), ?) AS d, i.sku, MAX(i.title),
+                   ? * SUM(i.qty), ? * SUM(i.qty * i.unit_price_minor)
+              FROM orders o
+              JOIN order_items i ON i.order_id = o.id
+             WHERE {where}
+             GROUP BY d, i.sku
+            ON CONFLICT(day, sku) DO UPDATE SET
+                title = excluded.title,
+                units = units + excluded.units,
+                revenue_minor = revenue_minor + excluded.revenue_minor
+        """, (shift, sign, sign, *params))
+
+async def _sales_apply_ids(db: aiosqlite.Connection, order_ids: List[int], sign: int, kind: str):
+    for i in range(0, len(order_ids), 500):
+        chunk = order_ids[i:i + 500]
+        await _sales_apply(db, f"o.id IN ({','.join('?' * len(chunk))})", tuple(chunk), sign, kind)
+
+async def _sales_rebuild(db: aiosqlite.Connection):
+    for table in ("sales_hourly", "sales_daily", "sales_sku_daily"):
+        await db.execute(f"DELETE FROM {table}")
+    for kind in SALES_STATUSES:
+        await _sales_apply(db, "o.status = ?", (kind,), +1, kind)
+
+async def db_rebuild_sales_aggregates():
+    """Пересчитать агрегаты целиком по orders (разово, например после смены часового пояса)."""
+    await _run_write(_sales_rebuild)
+
+async def db_sales_report(day_from: str, day_to: str, top: int = 10) -> Dict[str, Any]:
+    """Сводка продаж за дни [day_from, day_to] ('YYYY-MM-DD') только по таблицам агрегатов."""
+    async with _read() as db:
+        cur = await db.execute("""
+            SELECT COALESCE(SUM(delivered_orders), 0) AS delivered_orders,
+                   COALESCE(SUM(revenue_minor), 0) AS revenue_minor,
+                   COALESCE(SUM(delivery_fee_minor), 0) AS delivery_fee_minor,
+                   COALESCE(SUM(pickup_orders), 0) AS pickup_orders,
+                   COALESCE(SUM(courier_orders), 0) AS courier_orders,
+                   COALESCE(SUM(canceled_orders), 0) AS canceled_orders
+              FROM sales_daily
+             WHERE day BETWEEN ? AND ?
+        """, (day_from, day_to))
+        report = dict(await cur.fetchone())
+        cur = await db.execute("""
+            SELECT sku, MAX(title) AS title, SUM(units) AS units, SUM(revenue_minor) AS revenue_minor
+              FROM sales_sku_daily
+             WHERE day BETWEEN ? AND ?
+             GROUP BY sku
+            HAVING SUM(units) > 0
+             ORDER BY revenue_minor DESC
+             LIMIT ?
+        """, (day_from, day_to, top))
+        report["top_skus"] = [dict(r) for r in await cur.fetchall()]
+        cur = await db.execute("""
+            SELECT hour, delivered_orders, revenue_minor
+              FROM sales_hourly
+             WHERE hour BETWEEN ? AND ?
+             ORDER BY delivered_orders DESC, hour
+             LIMIT 1
+        """, (day_from + "T00", day_to + "T23"))
+        row = await cur.fetchone()
+        report["peak_hour"] = dict(row) if row and row["delivered_orders"] > 0 else None
+    return report
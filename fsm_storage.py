@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app.db import db_fsm_get, db_fsm_flush, db_fsm_purge
+
+logger = logging.getLogger(__name__)
+
+# Запись: (state, data, updated_at — unix time)
+Entry = Tuple[Optional[str], Dict[str, Any], float]
+
+
+def _key(key: StorageKey) -> str:
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id:
+        parts.append(f"t{key.thread_id}")
+    if key.business_connection_id:
+        parts.append(f"b{key.business_connection_id}")
+    if key.destiny != "default":
+        parts.append(key.destiny)
+    return ":".join(parts)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в нашей SQLite (таблица fsm_states), чтобы незаконченные
+    сценарии (регистрация, адрес, оформление) переживали перезапуск.
+
+    - Горячий кэш: последние cache_size ключей в памяти (LRU), чтение
+      без обращения к БД.
+    - Запись отложенная: изменения копятся и раз в flush_delay секунд
+      уходят одной транзакцией, несколько set_state/set_data одного
+      пользователя подряд превращаются в одну запись.
+    - Состояния, не менявшиеся дольше ttl, считаются брошенными:
+      не читаются и периодически удаляются из таблицы.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 7 * 24 * 3600,
+        cache_size: int = 5000,
+        flush_delay: float = 0.5,
+        purge_interval: float = 3600,
+    ):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_delay = flush_delay
+        self.purge_interval = purge_interval
+        self._cache: "OrderedDict[str, Entry]" = OrderedDict()
+        # ещё не записанные изменения; None — удалить строку
+        self._dirty: Dict[str, Optional[Entry]] = {}
+        self._wake = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+        self._last_purge = time.time()
+
+    # ---------- кэш ----------
+    def _remember(self, k: str, entry: Entry):
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, k: str) -> Entry:
+        now = time.time()
+        entry = self._cache.get(k)
+        if entry is None:
+            if k in self._dirty:
+                entry = self._dirty[k] or (None, {}, now)
+            else:
+                row = await db_fsm_get(k)
+                entry = (row["state"], json.loads(row["data"]), row["updated_at"]) if row else (None, {}, now)
+            self._remember(k, entry)
+        else:
+            self._cache.move_to_end(k)
+        if entry[0] is not None or entry[1]:
+            if entry[2] < now - self.ttl:
+                # брошенное состояние: забываем
+                entry = (None, {}, now)
+                self._put(k, entry)
+        return entry
+
+    def _put(self, k: str, entry: Entry):
+        self._remember(k, entry)
+        empty = entry[0] is None and not entry[1]
+        self._dirty[k] = None if empty else entry
+        self._wake.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    # ---------- BaseStorage ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _key(key)
+        _, data, _ = await self._load(k)
+        self._put(k, (state.state if isinstance(state, State) else state, data, time.time()))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(_key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        k = _key(key)
+        state, _, _ = await self._load(k)
+        self._put(k, (state, dict(data), time.time()))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(_key(key)))[1])
+
+    async def close(self) -> None:
+        """Записать всё накопленное и остановить фоновую запись."""
+        # задачу записи не отменяем: отмена посреди db_fsm_flush потеряла бы пачку.
+        # Просим цикл завершиться после текущей записи и ждём его
+        self._closing = True
+        self._wake.set()
+        if self._flusher is not None:
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    # ---------- запись ----------
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        upserts = [(k, e[0], json.dumps(e[1], ensure_ascii=False), e[2]) for k, e in batch.items() if e is not None]
+        deletes = [k for k, e in batch.items() if e is None]
+        try:
+            await db_fsm_flush(upserts, deletes)
+        except BaseException:
+            # вернуть в очередь то, что не перезаписано за время попытки
+            # (в том числе при отмене задачи)
+            for k, e in batch.items():
+                self._dirty.setdefault(k, e)
+            raise
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.purge_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if not self._closing:
+                # даём накопиться изменениям — так несколько шагов сценария пишутся одной транзакцией
+                await asyncio.sleep(self.flush_delay)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge >= self.purge_interval:
+                    self._last_purge = time.time()
+                    removed = await db_fsm_purge(self._last_purge - self.ttl)
+                    if removed:
+                        logger.info("FSM: удалено брошенных состояний: %s", removed)
+            except Exception:
+                logger.exception("FSM: ошибка записи состояний")
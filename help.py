@@ -9,9 +9,10 @@ async def help_menu(message: Message):
         "Помощь:\n"
         "— /start — начать, регистрация (имя + телефон).\n"
         "— Каталог — выберите категорию и добавляйте товары.\n"
+        "— Поиск или /search <текст> — найти товар по названию.\n"
         "— Корзина — просмотр и оформление.\n"
         "— Адрес доставки — сохраните адрес для курьера.\n"
         "— Оплатить онлайн — демо-кнопки, без реального списания.\n"
         "Статусы заказа: confirming → preparing → delivering → delivered.\n"
-        "Админ-команды: /set <id> <status>, /tariff <руб>, /seturl <URL>, /refresh"
+        "Админ-команды: /set <id|id,id|от-до> <status>, /tariff <руб>, /seturl <URL>, /refresh, /stats, /report [с] [по]"
     )
@@ -1,12 +1,47 @@
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
-from math import ceil
+
+from app.db import catalog_version
+
+# LRU готовых клавиатур каталога. Ключ включает версию каталога,
+# поэтому любое изменение товаров делает старые записи недостижимыми;
+# при смене версии кэш просто очищается.
+KB_CACHE_MAX = 512
+_kb_cache: "OrderedDict[Hashable, InlineKeyboardMarkup]" = OrderedDict()
+_kb_cache_version: Optional[int] = None
+
+def _kb_memo(key: Optional[Hashable], build: Callable[[], InlineKeyboardMarkup]) -> InlineKeyboardMarkup:
+    global _kb_cache_version
+    if key is None:
+        return build()
+    version = catalog_version()
+    if version != _kb_cache_version:
+        _kb_cache.clear()
+        _kb_cache_version = version
+    kb = _kb_cache.get(key)
+    if kb is not None:
+        _kb_cache.move_to_end(key)
+        return kb
+    kb = build()
+    _kb_cache[key] = kb
+    if len(_kb_cache) > KB_CACHE_MAX:
+        _kb_cache.popitem(last=False)
+    return kb
+
+# Тексты кнопок главного меню: в режимах ввода текста (поиск) их не считаем вводом
+MENU_TEXTS = frozenset({
+    "Каталог", "Поиск", "Корзина", "Адрес доставки", "Мой профиль",
+    "Оплатить онлайн", "Помощь", "Админ",
+})
 
 def main_menu_kb(is_admin: bool = False) -> ReplyKeyboardMarkup:
     keyboard = [
-        [KeyboardButton(text="Каталог"), KeyboardButton(text="Корзина")],
+        [KeyboardButton(text="Каталог"), KeyboardButton(text="Поиск"), KeyboardButton(text="Корзина")],
         [KeyboardButton(text="Адрес доставки"), KeyboardButton(text="Мой профиль")],
         [KeyboardButton(text="Оплатить онлайн"), KeyboardButton(text="Помощь")],
     ]
@@ -21,30 +56,44 @@ def contact_kb() -> ReplyKeyboardMarkup:
     ]
     return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True, one_time_keyboard=True)
 
-def products_list_kb(items: list[dict], page: int, total: int, page_size: int) -> InlineKeyboardMarkup:
+def plist_cb(direction: str, item: dict) -> str:
+    """callback_data страницы каталога по курсору: plist:<n|p|a>:<sort_order>:<id>."""
+    return f"plist:{direction}:{item['sort_order']}:{item['id']}"
+
+def products_list_kb(
+    items: list[dict], has_prev: bool, has_next: bool, cache_key: Optional[Hashable] = None
+) -> InlineKeyboardMarkup:
+    """cache_key (например, курсор и размер страницы) включает мемоизацию до изменения каталога."""
+    return _kb_memo(
+        ("plist", cache_key) if cache_key is not None else None,
+        lambda: _build_products_list_kb(items, has_prev, has_next)
+    )
+
+def _build_products_list_kb(items: list[dict], has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
     rows = []
+    # «Назад к списку» из карточки возвращает на эту же страницу (начиная с первого товара)
+    back = f"a:{items[0]['sort_order']}:{items[0]['id']}" if items else "1"
     for it in items:
         price_rub = it["price_minor"] // 100
         rows.append([InlineKeyboardButton(
             text=f"🔍 {it['title']} — {price_rub} ₽",
-            callback_data=f"view:{it['id']}:p:{page}"
+            callback_data=f"view:{it['id']}:{back}"
         )])
     # Пагинация
-    pages = max(1, ceil(total / max(1, page_size)))
     nav = []
-    if page > 1:
-        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"plist:{page-1}"))
-    if page < pages:
-        nav.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=f"plist:{page+1}"))
+    if has_prev and items:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=plist_cb("p", items[0])))
+    if has_next and items:
+        nav.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=plist_cb("n", items[-1])))
     if nav:
         rows.append(nav)
     return InlineKeyboardMarkup(inline_keyboard=rows or [[InlineKeyboardButton(text="Каталог пуст", callback_data="noop")]])
 
-def product_detail_kb(prod_id: int, page: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
+def product_detail_kb(prod_id: int, back: str) -> InlineKeyboardMarkup:
+    return _kb_memo(("detail", prod_id, back), lambda: InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Добавить в корзину", callback_data=f"add:{prod_id}")],
-        [InlineKeyboardButton(text="Назад к списку", callback_data=f"plist:{page}")]
-    ])
+        [InlineKeyboardButton(text="Назад к списку", callback_data=f"plist:{back}")]
+    ]))
 
 def cart_kb(has_items: bool) -> InlineKeyboardMarkup:
     rows = []
@@ -69,7 +118,41 @@ def admin_kb() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="Тариф доставки", callback_data="adm:tariff")]
     ])
 
-def admin_products_kb(products: list[dict]) -> InlineKeyboardMarkup:
+ORDER_BOARD_TABS = [
+    [("all", "Все активные")],
+    [("confirming", "Новые"), ("preparing", "Готовятся"), ("delivering", "В пути")],
+    [("delivered", "Доставлены"), ("canceled", "Отменены")],
+]
+
+def admin_orders_kb(current: str, counts: dict, first_id: Optional[int], last_id: Optional[int],
+                    has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    rows = []
+    for tabs in ORDER_BOARD_TABS:
+        row = []
+        for key, label in tabs:
+            n = counts.get(key)
+            text = f"{label} ({n})" if n is not None else label
+            if key == current:
+                text = "• " + text
+            row.append(InlineKeyboardButton(text=text, callback_data=f"adm:ord:{key}:n:0"))
+        rows.append(row)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="« Новее", callback_data=f"adm:ord:{current}:p:{first_id}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Старше »", callback_data=f"adm:ord:{current}:n:{last_id}"))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="Назад (Админ)", callback_data="adm:back")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def admin_products_kb(products: list[dict], cache_key: Optional[Hashable] = None) -> InlineKeyboardMarkup:
+    return _kb_memo(
+        ("admin", cache_key) if cache_key is not None else None,
+        lambda: _build_admin_products_kb(products)
+    )
+
+def _build_admin_products_kb(products: list[dict]) -> InlineKeyboardMarkup:
     rows = []
     for p in products:
         status = "ON" if p["available"] else "OFF"
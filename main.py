@@ -1,20 +1,43 @@
 import asyncio
+from typing import Optional
+
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
 
-from app.config import BOT_TOKEN, DEFAULT_COURIER_FEE_RUB
-from app.db import init_db
-from app.handlers import (
+from app.config import (
+    BOT_TOKEN, DEFAULT_COURIER_FEE_RUB, BOT_MODE, UPDATE_WORKERS, UPDATE_QUEUE_SIZE,
+    METRICS_HOST, METRICS_PORT, FSM_STATE_TTL_HOURS, FSM_CACHE_SIZE,
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST, SEND_INTERACTIVE_RESERVE
+)
+from app.db import init_db, close_db, set_query_observer
+from app import metrics
+from app.sms import close_sms
+from app.notifications import close_notifier
+from app.fsm_storage import SQLiteStorage
+from app.middlewares import UserContextMiddleware
+from app.send_scheduler import SendScheduler
+from app.update_scheduler import UpdateScheduler
+from app import (
     start_registration, address, catalog_cart, payments_demo, admin, help as help_h
 )
 
-async def main():
-    await init_db(default_courier_fee_rub=DEFAULT_COURIER_FEE_RUB)
-
-    bot = Bot(BOT_TOKEN)
-    dp = Dispatcher()
-
-    # если когда-то включали webhook — снимем, чтобы polling не конфликтовал
-    await bot.delete_webhook(drop_pending_updates=True)
+def build_dispatcher(
+    scheduler: Optional[UpdateScheduler] = None, storage: Optional[BaseStorage] = None
+) -> Dispatcher:
+    """Dispatcher со всеми middleware и роутерами бота (используется и нагрузочным тестом)."""
+    # FSM-состояния в SQLite: переживают перезапуск, в памяти — только горячие
+    dp = Dispatcher(storage=storage or SQLiteStorage(ttl=FSM_STATE_TTL_HOURS * 3600, cache_size=FSM_CACHE_SIZE))
+    if scheduler is not None:
+        # апдейты разных пользователей — параллельно, одного пользователя — по порядку
+        scheduler.attach(dp)
+        for key in ("busy", "queued", "max_queue_depth"):
+            metrics.GAUGES[f"bot_updates_{key}"] = lambda key=key: scheduler.stats()[key]
+    # пользователь и корзина — один раз на апдейт для всех роутеров
+    dp.message.outer_middleware(UserContextMiddleware())
+    dp.callback_query.outer_middleware(UserContextMiddleware())
+    # время каждого хендлера (см. /stats и /metrics)
+    dp.message.middleware(metrics.HandlerTimingMiddleware())
+    dp.callback_query.middleware(metrics.HandlerTimingMiddleware())
 
     dp.include_routers(
         start_registration.router,
@@ -24,9 +47,41 @@ async def main():
         admin.router,
         help_h.router,
     )
+    return dp
+
+async def main():
+    set_query_observer(metrics.observe_db)
+    await init_db(default_courier_fee_rub=DEFAULT_COURIER_FEE_RUB)
+    metrics_runner = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    bot = Bot(BOT_TOKEN)
+    # все исходящие сообщения — через лимиты Telegram (на чат и на бота)
+    bot.session.middleware(SendScheduler(
+        global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE,
+        chat_burst=SEND_CHAT_BURST, reserve=SEND_INTERACTIVE_RESERVE,
+    ))
+    scheduler = UpdateScheduler(workers=UPDATE_WORKERS, queue_size=UPDATE_QUEUE_SIZE)
+    dp = build_dispatcher(scheduler)
 
     print("Bot is running...")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            from app.webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            # если когда-то включали webhook — снимем, чтобы polling не конфликтовал
+            await bot.delete_webhook(drop_pending_updates=True)
+            # апдейты ставит в очередь планировщик, отдельные задачи не нужны
+            await dp.start_polling(bot, handle_as_tasks=False)
+    finally:
+        await scheduler.close()
+        await close_notifier()
+        # dp закрывает хранилище при остановке; повторно — для состояний, записанных после этого
+        await dp.storage.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_sms()
+        await close_db()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,203 @@
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+# Границы корзин гистограмм, секунды (как у клиентов Prometheus, плюс мелкие для SQL)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Защита от взрыва числа рядов (например, при подделанных callback data)
+MAX_SERIES = 500
+OTHER = "other"
+
+Labels = Tuple[str, ...]
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами, ряды — по значениям меток."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        # labels -> [counts по корзинам..., +Inf], sum
+        self.series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, labels: Labels, seconds: float):
+        s = self.series.get(labels)
+        if s is None:
+            if len(self.series) >= MAX_SERIES:
+                labels = (OTHER,) * len(self.label_names)
+                s = self.series.get(labels)
+            if s is None:
+                s = ([0] * (len(BUCKETS) + 1), [0.0])
+                self.series[labels] = s
+        s[0][bisect_left(BUCKETS, seconds)] += 1
+        s[1][0] += seconds
+
+    def quantile(self, labels: Labels, q: float) -> float:
+        """Оценка квантиля по корзинам (верхняя граница корзины, как histogram_quantile без интерполяции)."""
+        counts, _ = self.series[labels]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        acc = 0
+        for i, c in enumerate(counts):
+            acc += c
+            if acc >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+        return BUCKETS[-1]
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Ряды с count/sum/p50/p95 — для /stats."""
+        out = []
+        for labels, (counts, total) in self.series.items():
+            n = sum(counts)
+            out.append({
+                "labels": dict(zip(self.label_names, labels)),
+                "count": n,
+                "sum": total[0],
+                "avg": total[0] / n if n else 0.0,
+                "p50": self.quantile(labels, 0.50),
+                "p95": self.quantile(labels, 0.95),
+            })
+        return out
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.series.items()):
+            base = _label_str(self.label_names, labels)
+            acc = 0
+            for bound, c in zip(BUCKETS, counts):
+                acc += c
+                lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {acc}')
+            acc += counts[-1]
+            lines.append(f'{self.name}_bucket{{{base}{"," if base else ""}le="+Inf"}} {acc}')
+            lines.append(f"{self.name}_sum{{{base}}} {total[0]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {acc}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.series: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, value: float = 1.0):
+        if labels not in self.series and len(self.series) >= MAX_SERIES:
+            labels = (OTHER,) * len(self.label_names)
+        self.series[labels] = self.series.get(labels, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{{{_label_str(self.label_names, labels)}}} {value:g}")
+        return lines
+
+
+def _label_str(names: Tuple[str, ...], values: Labels) -> str:
+    def esc(v: str) -> str:
+        return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{n}="{esc(str(v))}"' for n, v in zip(names, values))
+
+
+# ---------------------- REGISTRY ----------------------
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds", "Время выполнения хендлера.", ("router", "handler", "prefix")
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах.", ("router", "handler", "prefix")
+)
+DB_QUERY_SECONDS = Histogram(
+    "bot_db_query_seconds", "Время SQL по вызывающей функции db.py (выборка строк — с суффиксом :fetch).", ("query",)
+)
+
+REGISTRY: List[Any] = [HANDLER_SECONDS, HANDLER_ERRORS, DB_QUERY_SECONDS]
+# Дополнительные значения на момент сбора (например, очереди планировщика): имя -> функция
+GAUGES: Dict[str, Callable[[], float]] = {}
+
+
+def observe_db(query: str, seconds: float):
+    DB_QUERY_SECONDS.observe((query,), seconds)
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, fn in sorted(GAUGES.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {fn():g}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.series.clear()
+
+
+# ---------------------- HANDLER TIMING ----------------------
+def _callback_prefix(data: Optional[str]) -> str:
+    """'adm:prod:toggle:5' -> 'adm:prod:toggle', 'plist:n:0:12' -> 'plist:n': без id и чисел."""
+    if not data:
+        return ""
+    parts = []
+    for p in data.split(":")[:3]:
+        if any(ch.isdigit() for ch in p):
+            break
+        parts.append(p)
+    return ":".join(parts)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: замеряет время каждого сработавшего хендлера.
+    Метки: router — модуль хендлера, handler — имя функции,
+    prefix — префикс callback data (для сообщений пусто).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        obj = data.get("handler")
+        callback = getattr(obj, "callback", None)
+        router = (getattr(callback, "__module__", "") or "").rsplit(".", 1)[-1]
+        name = getattr(callback, "__name__", "") or ""
+        prefix = _callback_prefix(event.data) if isinstance(event, CallbackQuery) else ""
+        labels = (router, name, prefix)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(labels)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(labels, time.perf_counter() - t0)
+
+
+# ---------------------- HTTP ----------------------
+async def start_metrics_server(host: str, port: int):
+    """
+    Отдаёт GET /metrics на host:port. Возвращает aiohttp AppRunner
+    (закрыть через runner.cleanup()).
+    """
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,38 @@
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.db import db_get_user_by_tg, db_get_or_create_cart
+
+
+class CartRef:
+    """Корзина пользователя, которая создаётся/ищется только при первом обращении."""
+
+    def __init__(self, user: Optional[Dict[str, Any]]):
+        self._user = user
+        self._id: Optional[int] = None
+
+    async def id(self) -> Optional[int]:
+        if self._id is None and self._user:
+            self._id = await db_get_or_create_cart(self._user["id"])
+        return self._id
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Outer-middleware: один раз на апдейт находит пользователя по tg_id
+    (через TTL-кэш в db) и передаёт в хендлеры параметры `user` и `cart`.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        user = await db_get_user_by_tg(from_user.id) if from_user else None
+        data["user"] = user
+        data["cart"] = CartRef(user)
+        return await handler(event, data)
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from app.config import NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE
+from app.send_scheduler import background_sends
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {
+    "confirming": "принят и ждёт подтверждения",
+    "preparing": "готовится",
+    "delivering": "передан курьеру",
+    "delivered": "доставлен. Спасибо за заказ!",
+    "canceled": "отменён",
+}
+
+
+def status_message(order_id: int, status: str) -> str:
+    return f"Заказ #{order_id} {STATUS_TEXT.get(status, status)}."
+
+
+class Notifier:
+    """
+    Фоновая очередь уведомлений покупателям. Хендлер только ставит
+    сообщения в очередь; воркеры отправляют их с фоновым приоритетом
+    (см. send_scheduler.background_sends), так что массовая смена
+    статусов не задерживает ни админ-чат, ни ответы другим пользователям.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.workers_count = max(1, workers)
+        self._workers: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    def enqueue(self, bot: Bot, chat_id: int, text: str) -> bool:
+        if not self._workers:
+            self._start()
+        try:
+            self.queue.put_nowait((bot, chat_id, text))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Очередь уведомлений переполнена, сообщение для %s отброшено", chat_id)
+            return False
+
+    async def _worker(self):
+        with background_sends():
+            while True:
+                bot, chat_id, text = await self.queue.get()
+                try:
+                    await bot.send_message(chat_id, text)
+                    self.sent += 1
+                except TelegramAPIError as e:
+                    # пользователь заблокировал бота и т.п. — не повторяем
+                    self.failed += 1
+                    logger.info("Уведомление для %s не доставлено: %s", chat_id, e)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Ошибка отправки уведомления для %s", chat_id)
+                finally:
+                    self.queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "sent": self.sent, "failed": self.failed, "dropped": self.dropped}
+
+    async def close(self, timeout: Optional[float] = 10.0):
+        """Дослать очередь (не дольше timeout) и остановить воркеров."""
+        if self._workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Остановка: не отправлено уведомлений: %s", self.queue.qsize())
+            for w in self._workers:
+                w.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+
+
+_notifier: Optional[Notifier] = None
+
+
+def get_notifier() -> Notifier:
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier(NOTIFY_WORKERS, NOTIFY_QUEUE_SIZE)
+    return _notifier
+
+
+def notify_status_changed(bot: Bot, changed: List[Tuple[int, Optional[int]]], status: str) -> int:
+    """Поставить в очередь уведомления о новом статусе; возвращает, сколько поставлено."""
+    notifier = get_notifier()
+    return sum(
+        notifier.enqueue(bot, tg_id, status_message(order_id, status))
+        for order_id, tg_id in changed if tg_id
+    )
+
+
+async def close_notifier():
+    global _notifier
+    if _notifier is not None:
+        await _notifier.close()
+        _notifier = None
@@ -0,0 +1,98 @@
+import hmac
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.config import OTP_TTL_MINUTES, OTP_MAX_ATTEMPTS, OTP_RESEND_COOLDOWN_SECONDS
+from app.utils import hash_otp
+
+OTP_STORE_MAX = 100000
+
+# Результаты verify()
+OTP_OK = "ok"
+OTP_WRONG = "wrong"
+OTP_EXPIRED = "expired"
+OTP_MISSING = "missing"
+OTP_LOCKED = "locked"
+
+
+class OtpStore:
+    """
+    Коды подтверждения в памяти процесса, а не в таблице users: запрос кода
+    и неверные попытки не трогают БД, в неё пишется только итог (телефон
+    подтверждён). Записи живут ttl секунд и вытесняются по истечении или при
+    переполнении (самые старые). На код даётся max_attempts попыток, новый
+    код — не чаще раза в resend_cooldown секунд.
+    """
+
+    def __init__(self, ttl: float, max_attempts: int, resend_cooldown: float, max_entries: int = OTP_STORE_MAX):
+        self.ttl = ttl
+        self.max_attempts = max(1, max_attempts)
+        self.resend_cooldown = resend_cooldown
+        self.max_entries = max_entries
+        # tg_id -> {"phone", "code_hash", "expires", "sent_at", "attempts"}; порядок = порядок выдачи
+        self._items: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+    def _evict(self, now: float):
+        # записи упорядочены по времени выдачи, а TTL у всех одинаковый
+        while self._items:
+            entry = next(iter(self._items.values()))
+            if entry["expires"] > now and len(self._items) <= self.max_entries:
+                break
+            self._items.popitem(last=False)
+
+    def _get(self, tg_id: int, now: float) -> Optional[Dict[str, Any]]:
+        self._evict(now)
+        return self._items.get(tg_id)
+
+    def cooldown(self, tg_id: int) -> int:
+        """Через сколько секунд можно запросить новый код (0 — можно сейчас)."""
+        now = time.monotonic()
+        entry = self._get(tg_id, now)
+        if entry is None:
+            return 0
+        left = entry["sent_at"] + self.resend_cooldown - now
+        return int(left) + 1 if left > 0 else 0
+
+    def pending_phone(self, tg_id: int) -> Optional[str]:
+        """Телефон, на который выдан ещё действующий код (None — такого кода нет)."""
+        entry = self._get(tg_id, time.monotonic())
+        if entry is None or entry["attempts"] >= self.max_attempts:
+            return None
+        return entry["phone"]
+
+    def issue(self, tg_id: int, phone: str, code: str):
+        """Запомнить новый код (старый, если был, перестаёт действовать)."""
+        now = time.monotonic()
+        self._items.pop(tg_id, None)
+        self._items[tg_id] = {
+            "phone": phone,
+            "code_hash": hash_otp(code),
+            "expires": now + self.ttl,
+            "sent_at": now,
+            "attempts": 0,
+        }
+        self._evict(now)
+
+    def verify(self, tg_id: int, code: str) -> Dict[str, Any]:
+        """
+        Проверить код. Возвращает {"status", "phone", "attempts_left"}; при OTP_OK
+        запись удаляется, при исчерпании попыток код блокируется до истечения TTL
+        (чтобы не обходить кулдаун повторной отправки).
+        """
+        now = time.monotonic()
+        expired = self._items.get(tg_id, {}).get("expires", now + 1) <= now
+        entry = self._get(tg_id, now)
+        if entry is None:
+            return {"status": OTP_EXPIRED if expired else OTP_MISSING, "phone": None, "attempts_left": 0}
+        if entry["attempts"] >= self.max_attempts:
+            return {"status": OTP_LOCKED, "phone": None, "attempts_left": 0}
+        if hmac.compare_digest(hash_otp(code), entry["code_hash"]):
+            del self._items[tg_id]
+            return {"status": OTP_OK, "phone": entry["phone"], "attempts_left": 0}
+        entry["attempts"] += 1
+        left = self.max_attempts - entry["attempts"]
+        return {"status": OTP_WRONG if left else OTP_LOCKED, "phone": None, "attempts_left": left}
+
+
+otp_store = OtpStore(OTP_TTL_MINUTES * 60, OTP_MAX_ATTEMPTS, OTP_RESEND_COOLDOWN_SECONDS)
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+
+from app import metrics
+from app.update_scheduler import worker_released
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Приоритет исходящих запросов текущей задачи: ответы пользователю — interactive,
+# рассылки и уведомления оборачиваются в background_sends()
+_priority: ContextVar[str] = ContextVar("send_priority", default=INTERACTIVE)
+
+CHAT_BUCKETS_MAX = 10000
+RETRY_AFTER_ATTEMPTS = 3
+
+SEND_WAIT_SECONDS = metrics.Histogram(
+    "bot_send_wait_seconds", "Ожидание в планировщике перед отправкой в Telegram.", ("priority",)
+)
+SEND_TOTAL = metrics.Counter(
+    "bot_send_requests_total", "Исходящие запросы к Telegram с chat_id.", ("method", "priority")
+)
+SEND_RETRY_AFTER = metrics.Counter(
+    "bot_send_retry_after_total", "Ответы Telegram «Too Many Requests» (retry_after).", ("method",)
+)
+metrics.REGISTRY.extend([SEND_WAIT_SECONDS, SEND_TOTAL, SEND_RETRY_AFTER])
+
+
+@contextmanager
+def background_sends() -> Iterator[None]:
+    """Отправки внутри блока идут с фоновым приоритетом (уступают ответам пользователям)."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Bucket:
+    """Token bucket: rate токенов в секунду, не больше burst про запас."""
+
+    __slots__ = ("rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now: float, reserve: float = 0.0) -> float:
+        """Сколько ждать до токена (с учётом неприкосновенного запаса reserve); 0 — можно сейчас."""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        need = 1.0 + reserve - self.tokens
+        return need / self.rate if need > 0 else 0.0
+
+    def take(self):
+        self.tokens -= 1.0
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Request-middleware сессии Bot: перед каждым запросом с chat_id
+    (sendMessage, editMessageText, sendPhoto, ...) ждёт токен в бакете
+    чата и в общем бакете бота, чтобы не упираться в лимиты Telegram
+    (≈30 сообщений/с на бота, ≈1/с на чат). Фоновые отправки не трогают
+    последние `reserve` токенов общего бакета, поэтому ответы пользователям
+    проходят первыми. На TelegramRetryAfter чат ставится на паузу на
+    retry_after секунд, и запрос повторяется. На время ожидания хендлер
+    отдаёт свой слот UpdateScheduler (update_scheduler.worker_released).
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3, reserve: float = 5):
+        self.global_bucket = _Bucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.reserve = min(reserve, max(0.0, global_rate - 1))
+        self._chats: "OrderedDict[Any, _Bucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Any) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = _Bucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > CHAT_BUCKETS_MAX:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id: Any, priority: str):
+        chat = self._chat_bucket(chat_id)
+        # фоновым нужен токен сверх запаса: при восстановлении бакета с нуля
+        # интерактивные всегда получают токен раньше фоновых
+        reserve = 0.0 if priority == INTERACTIVE else self.reserve
+        while True:
+            now = time.monotonic()
+            wait = max(chat.delay(now), self.global_bucket.delay(now, reserve))
+            if not wait:
+                chat.take()
+                self.global_bucket.take()
+                return
+            # пока ждём, воркер планировщика апдейтов обслуживает других пользователей
+            async with worker_released():
+                await asyncio.sleep(wait)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[Any],
+        bot: Bot,
+        method: TelegramMethod[Any],
+    ) -> Response[Any]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # answerCallbackQuery, getMe и т.п. — без лимитов на сообщения
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        name = type(method).__name__
+        SEND_TOTAL.inc((name, priority))
+        for attempt in range(1, RETRY_AFTER_ATTEMPTS + 1):
+            t0 = time.monotonic()
+            await self._acquire(chat_id, priority)
+            SEND_WAIT_SECONDS.observe((priority,), time.monotonic() - t0)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                SEND_RETRY_AFTER.inc((name,))
+                until = time.monotonic() + e.retry_after
+                chat = self._chat_bucket(chat_id)
+                chat.paused_until = max(chat.paused_until, until)
+                # остальные чаты не останавливаем, но обнуляем общий запас — темп сразу снижается
+                self.global_bucket.tokens = 0.0
+                logger.warning("Telegram retry_after=%ss (%s, chat %s)", e.retry_after, name, chat_id)
+                if attempt >= RETRY_AFTER_ATTEMPTS:
+                    raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chats": len(self._chats),
+            "global_tokens": round(self.global_bucket.tokens, 1),
+        }
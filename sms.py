@@ -1,31 +1,228 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
 import httpx
-from app.config import SMS_PROVIDER, SMS_API_KEY, SMS_SENDER
+from app.config import (
+    SMS_PROVIDER, SMS_API_KEY, SMS_SENDER,
+    SMS_WORKERS, SMS_QUEUE_SIZE, SMS_RATE_PER_SECOND, SMS_PHONE_INTERVAL_SECONDS,
+    SMS_MAX_ATTEMPTS, SMS_MOCK_DELAY_MS
+)
 
-async def send_sms(phone: str, text: str) -> bool:
+logger = logging.getLogger(__name__)
+
+SMS_RU_URL = "https://sms.ru/sms/send"
+RETRY_BASE_SECONDS = 1.0
+PHONES_TRACKED_MAX = 100000
+
+
+class SmsTemporaryError(Exception):
+    """Сбой, который имеет смысл повторить (сеть, таймаут, 5xx)."""
+
+
+# ---------------------- HTTP CLIENT ----------------------
+# Один клиент на процесс: соединение с шлюзом (и TLS-сессия) переиспользуется
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(max_connections=max(1, SMS_WORKERS), max_keepalive_connections=max(1, SMS_WORKERS)),
+        )
+    return _client
+
+
+# ---------------------- PROVIDERS ----------------------
+# Локальная заглушка (SMS_PROVIDER=mock): сообщения складываются сюда, без сети
+mock_outbox: Deque[Tuple[str, str]] = deque(maxlen=1000)
+
+
+async def _send_sms_ru(phone: str, text: str) -> bool:
+    # Документация: https://sms.ru/api/send
+    params = {
+        "api_id": SMS_API_KEY,
+        "to": phone,
+        "msg": text,
+        "json": 1,
+    }
+    if SMS_SENDER:
+        params["from"] = SMS_SENDER
+    try:
+        r = await _get_client().get(SMS_RU_URL, params=params)
+    except httpx.HTTPError as e:
+        raise SmsTemporaryError(str(e)) from e
+    if r.status_code >= 500 or r.status_code == 429:
+        raise SmsTemporaryError(f"HTTP {r.status_code}")
+    r.raise_for_status()
+    data = r.json()
+    if str(data.get("status")) != "OK":
+        logger.warning("SMS.ru отклонил SMS: %s", data)
+        return False
+    return True
+
+
+async def _send_once(phone: str, text: str) -> bool:
     # Тестовый режим — просто печатаем код
     if SMS_PROVIDER == "dev":
         print(f"[DEV SMS] to={phone} text={text}")
         return True
-
+    if SMS_PROVIDER == "mock":
+        if SMS_MOCK_DELAY_MS:
+            await asyncio.sleep(SMS_MOCK_DELAY_MS / 1000)
+        mock_outbox.append((phone, text))
+        return True
     if SMS_PROVIDER == "sms_ru":
-        # Документация: https://sms.ru/api/send
-        params = {
-            "api_id": SMS_API_KEY,
-            "to": phone,
-            "msg": text,
-            "json": 1,
-        }
-        if SMS_SENDER:
-            params["from"] = SMS_SENDER
+        return await _send_sms_ru(phone, text)
+
+    logger.error("Неизвестный SMS_PROVIDER: %s", SMS_PROVIDER)
+    return False
+
+
+async def send_sms(phone: str, text: str) -> bool:
+    """Отправить SMS сразу (с повторами при временных сбоях)."""
+    for attempt in range(1, max(1, SMS_MAX_ATTEMPTS) + 1):
         try:
-            async with httpx.AsyncClient(timeout=10) as c:
-                r = await c.get("https://sms.ru/sms/send", params=params)
-                r.raise_for_status()
-                data = r.json()
-                return str(data.get("status")) == "OK"
-        except Exception as e:
-            print(f"[SMS_RU] error: {e}")
+            return await _send_once(phone, text)
+        except SmsTemporaryError as e:
+            if attempt >= SMS_MAX_ATTEMPTS:
+                logger.error("SMS не отправлено после %s попыток: %s", attempt, e)
+                return False
+            # экспоненциальная пауза с разбросом, чтобы не долбить шлюз синхронно
+            delay = RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        except Exception:
+            logger.exception("Ошибка отправки SMS")
             return False
-
-    print(f"[SMS] Unsupported provider: {SMS_PROVIDER}")
     return False
+
+
+# ---------------------- OUTBOUND QUEUE ----------------------
+class _RateLimiter:
+    """Не больше rate отправок в секунду на весь процесс (0 — без ограничения)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class SmsQueue:
+    """
+    Очередь исходящих SMS с воркерами. Хендлер только ставит сообщение
+    в очередь и сразу отвечает пользователю, а медленный шлюз и повторы
+    обрабатываются в фоне. На один номер — не чаще phone_interval секунд,
+    на весь бот — не больше rate сообщений в секунду.
+    """
+
+    def __init__(self, workers: int, queue_size: int, rate: float, phone_interval: float):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.workers_count = max(1, workers)
+        self.phone_interval = phone_interval
+        self._limiter = _RateLimiter(rate)
+        self._last_by_phone: "OrderedDict[str, float]" = OrderedDict()
+        self._workers: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+
+    def _start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    def retry_after(self, phone: str) -> int:
+        """Через сколько секунд на этот номер можно отправить снова (0 — можно сейчас)."""
+        last = self._last_by_phone.get(phone)
+        if last is None:
+            return 0
+        left = last + self.phone_interval - time.monotonic()
+        return int(left) + 1 if left > 0 else 0
+
+    def enqueue(self, phone: str, text: str) -> int:
+        """
+        Поставить SMS в очередь. Возвращает 0, если принято, иначе — через
+        сколько секунд повторить (номер недавно получал SMS или очередь полна).
+        """
+        wait = self.retry_after(phone)
+        if wait:
+            return wait
+        if not self._workers:
+            self._start()
+        try:
+            self.queue.put_nowait((phone, text))
+        except asyncio.QueueFull:
+            logger.warning("Очередь SMS переполнена (%s)", self.queue.qsize())
+            return 5
+        self._last_by_phone[phone] = time.monotonic()
+        self._last_by_phone.move_to_end(phone)
+        while len(self._last_by_phone) > PHONES_TRACKED_MAX:
+            self._last_by_phone.popitem(last=False)
+        return 0
+
+    async def _worker(self):
+        while True:
+            phone, text = await self.queue.get()
+            try:
+                await self._limiter.acquire()
+                if await send_sms(phone, text):
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    logger.warning("SMS на %s не доставлено", phone)
+            except Exception:
+                self.failed += 1
+                logger.exception("Ошибка отправки SMS на %s", phone)
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "sent": self.sent, "failed": self.failed}
+
+    async def close(self, timeout: Optional[float] = 10.0):
+        """Дождаться отправки очереди (не дольше timeout) и остановить воркеров."""
+        if self._workers:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Остановка: в очереди остались неотправленные SMS (%s)", self.queue.qsize())
+            for w in self._workers:
+                w.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+            self._workers = []
+
+
+_queue: Optional[SmsQueue] = None
+
+
+def _get_queue() -> SmsQueue:
+    global _queue
+    if _queue is None:
+        _queue = SmsQueue(SMS_WORKERS, SMS_QUEUE_SIZE, SMS_RATE_PER_SECOND, SMS_PHONE_INTERVAL_SECONDS)
+    return _queue
+
+
+def enqueue_sms(phone: str, text: str) -> int:
+    """Отправить SMS в фоне. 0 — принято, иначе — сколько секунд подождать."""
+    return _get_queue().enqueue(phone, text)
+
+
+async def close_sms():
+    """Дослать очередь и закрыть HTTP-клиент (при остановке бота)."""
+    global _queue, _client
+    if _queue is not None:
+        await _queue.close()
+        _queue = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
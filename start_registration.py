@@ -1,24 +1,24 @@
-from datetime import datetime, timedelta
+from typing import Optional
 from aiogram import Router, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 
 from app.db import (
-    db_get_user_by_tg, db_create_or_update_user_base,
-    db_set_user_phone_and_otp, db_mark_user_verified, db_get_default_address
+    db_create_or_update_user_base,
+    db_set_user_phone_verified, db_get_default_address
 )
 from app.keyboards import main_menu_kb, contact_kb
-from app.utils import normalize_phone, format_address, make_otp_code, hash_otp
-from app.states import Reg
-from app.config import ADMIN_TG_IDS, OTP_TTL_MINUTES
-from app.sms import send_sms
+from app.utils import normalize_phone, format_address, make_otp_code
+from app.states import Reg, Search
+from app.config import ADMIN_TG_IDS
+from app.otp import otp_store, OTP_OK, OTP_WRONG, OTP_EXPIRED, OTP_LOCKED
+from app.sms import enqueue_sms
 
 router = Router()
 
 @router.message(CommandStart())
-async def start(message: Message, state: FSMContext):
-    user = await db_get_user_by_tg(message.from_user.id)
+async def start(message: Message, state: FSMContext, user: Optional[dict]):
     if user and user.get("is_verified"):
         is_admin = message.from_user.id in ADMIN_TG_IDS
         await state.clear()
@@ -62,50 +62,55 @@ async def reg_phone(message: Message, state: FSMContext):
         await message.answer("Не удалось распознать номер. Попробуйте снова или нажмите «Отмена».")
         return
 
-    code = make_otp_code()
-    ok = await send_sms(phone, f"Ваш код подтверждения: {code}")
-    if not ok:
-        await message.answer("Не удалось отправить SMS. Попробуйте позже.")
+    wait = otp_store.cooldown(message.from_user.id)
+    if wait and otp_store.pending_phone(message.from_user.id) == phone:
+        # код на этот номер ещё действует — просто ждём его ввода
+        await message.answer(
+            f"Код уже отправлен на этот номер. Введите его цифрами (новый можно запросить через {wait} сек.):"
+        )
+        await state.set_state(Reg.waiting_otp)
+        return
+    if not wait:
+        code = make_otp_code()
+        # SMS уходит в фоне через очередь — не ждём ответа шлюза
+        wait = enqueue_sms(phone, f"Ваш код подтверждения: {code}")
+    if wait:
+        await message.answer(f"Код уже отправлен недавно. Повторно запросить можно через {wait} сек.")
         return
 
-    expires = (datetime.utcnow() + timedelta(minutes=OTP_TTL_MINUTES)).isoformat()
-    await db_set_user_phone_and_otp(
-        tg_id=message.from_user.id,
-        phone=phone,
-        otp_code_hash=hash_otp(code),
-        expires_iso=expires
-    )
+    # код храним в памяти (app.otp), в БД попадёт только подтверждённый телефон
+    otp_store.issue(message.from_user.id, phone, code)
     await message.answer("Код отправлен по SMS. Введите код цифрами:")
     await state.set_state(Reg.waiting_otp)
 
 @router.message(Reg.waiting_otp)
 async def reg_otp(message: Message, state: FSMContext):
     code = (message.text or "").strip()
-    user = await db_get_user_by_tg(message.from_user.id)
-    if not user or not user.get("otp_code_hash"):
-        await state.clear()
-        await message.answer("Сессия подтверждения не найдена. Начните заново: /start")
+    res = otp_store.verify(message.from_user.id, code)
+    if res["status"] == OTP_WRONG:
+        await message.answer(f"Неверный код. Осталось попыток: {res['attempts_left']}.")
         return
-    try:
-        exp = datetime.fromisoformat(user["otp_expires_at"]) if user.get("otp_expires_at") else None
-    except:
-        exp = None
-    if not exp or exp < datetime.utcnow():
+    if res["status"] != OTP_OK:
         await state.clear()
-        await message.answer("Срок действия кода истёк. Запросите код ещё раз: /start")
-        return
-    if hash_otp(code) != user["otp_code_hash"]:
-        await message.answer("Неверный код. Попробуйте ещё раз.")
+        if res["status"] == OTP_EXPIRED:
+            await message.answer("Срок действия кода истёк. Запросите код ещё раз: /start")
+        elif res["status"] == OTP_LOCKED:
+            await message.answer("Слишком много неверных попыток. Запросите новый код позже: /start")
+        else:
+            await message.answer("Сессия подтверждения не найдена. Начните заново: /start")
         return
 
-    await db_mark_user_verified(message.from_user.id)
+    await db_set_user_phone_verified(message.from_user.id, res["phone"])
     await state.clear()
     is_admin = message.from_user.id in ADMIN_TG_IDS
     await message.answer("Телефон подтверждён! Добро пожаловать.", reply_markup=main_menu_kb(is_admin))
 
 @router.message(F.text == "Мой профиль")
-async def my_profile(message: Message):
-    user = await db_get_user_by_tg(message.from_user.id)
+async def my_profile(message: Message, user: Optional[dict], state: FSMContext):
+    # роутер регистрации подключён раньше каталога, и выход из поиска
+    # в catalog_cart сюда не доходит — сбрасываем ожидание запроса сами
+    if await state.get_state() == Search.waiting_query.state:
+        await state.clear()
     if not user:
         await message.answer("Вы ещё не зарегистрированы. Нажмите /start.")
         return
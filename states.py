@@ -3,6 +3,7 @@ from aiogram.fsm.state import State, StatesGroup
 class Reg(StatesGroup):
     waiting_name = State()
     waiting_phone = State()
+    waiting_otp = State()      # добавили состояние для ввода кода
 
 class Addr(StatesGroup):
     address_line = State()
@@ -14,11 +15,6 @@ class Addr(StatesGroup):
 class AdminStates(StatesGroup):
     waiting_tariff = State()
     waiting_catalog_url = State()
-from aiogram.fsm.state import State, StatesGroup
-
-class Reg(StatesGroup):
-    waiting_name = State()
-    waiting_phone = State()
-    waiting_otp = State()      # добавили состояние для ввода кода
 
-# остальные StatesGroup без изменений
+class Search(StatesGroup):
+    waiting_query = State()
@@ -0,0 +1,41 @@
+"""
+Общая настройка тестов.
+
+Модули бота импортируют друг друга как app.*, поэтому каталог репозитория
+должен быть пакетом app: если он называется иначе (checkout в CI), пакет
+открывается через симлинк во временном каталоге. Окружение задаётся до
+импорта app.config — значения из .env (токен, SMS-шлюз, рабочая БД) в тесты
+не попадают.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TMP = tempfile.mkdtemp(prefix="bot_tests_")
+
+os.environ.update({
+    "BOT_TOKEN": "42:TEST",
+    "BOT_MODE": "polling",
+    "ADMIN_TG_IDS": "",
+    "SMS_PROVIDER": "mock",
+    "SMS_API_KEY": "",
+    "DB_PATH": os.path.join(_TMP, "test.db"),
+})
+
+if os.path.basename(ROOT) == "app":
+    sys.path.insert(0, os.path.dirname(ROOT))
+else:
+    os.symlink(ROOT, os.path.join(_TMP, "app"))
+    sys.path.insert(0, _TMP)
+
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """Модуль app.db с отдельной пустой БД на тест (init_db/close_db — в самом тесте)."""
+    from app import db
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "test.db"))
+    return db
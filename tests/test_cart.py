@@ -0,0 +1,23 @@
+import asyncio
+
+
+def test_existing_cart_is_found_without_the_writer(app_db, monkeypatch):
+    async def scenario():
+        await app_db.init_db()
+        try:
+            await app_db.db_create_or_update_user_base(1001, "Покупатель")
+            user = await app_db.db_get_user_by_tg(1001)
+            cart_id = await app_db.db_get_or_create_cart(user["id"])
+
+            writes = []
+            run_write = app_db._run_write
+
+            async def counting_run_write(job):
+                writes.append(job)
+                return await run_write(job)
+            monkeypatch.setattr(app_db, "_run_write", counting_run_write)
+            assert await app_db.db_get_or_create_cart(user["id"]) == cart_id
+            assert writes == []
+        finally:
+            await app_db.close_db()
+    asyncio.run(scenario())
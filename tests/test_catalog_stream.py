@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from app.catalog import CatalogFormatError, _JsonStream, iter_catalog_categories
+
+CATALOG = {
+    "version": 3,
+    "categories": [
+        {"id": "bread", "title": "Хлеб", "items": [
+            {"sku": "B-001", "title": "Батон", "price_rub": 65.5, "available": True},
+            {"sku": "B-002", "title": "Бородинский", "price_rub": 1234567, "available": False},
+        ]},
+        {"id": "empty", "title": "Пусто", "items": []},
+    ],
+}
+
+
+async def _chunks(text, size):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def _read(text, size):
+    async def scenario():
+        return [pair async for pair in iter_catalog_categories(_chunks(text, size))]
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100000])
+def test_categories_are_read_whatever_the_chunk_size(size):
+    text = json.dumps(CATALOG, ensure_ascii=False, indent=1)
+    result = _read(text, size)
+    assert result == [
+        ({"id": "bread", "title": "Хлеб"}, CATALOG["categories"][0]["items"]),
+        ({"id": "empty", "title": "Пусто"}, []),
+    ]
+
+
+def test_number_split_between_chunks_is_read_whole():
+    async def scenario():
+        stream = _JsonStream(_chunks("[12345, 6]", 3))
+        values = []
+        async for _ in stream.items():
+            values.append(await stream.value())
+        return values
+    assert asyncio.run(scenario()) == [12345, 6]
+
+
+@pytest.mark.parametrize("text", [
+    '{"categories": [{"items": [1 2]}]}',
+    '{"categories": [}',
+    '{"categories": []} []',
+    '{"categories": [{"items": [{"sku": "x"',
+])
+def test_malformed_catalog_is_rejected(text):
+    with pytest.raises(CatalogFormatError):
+        _read(text, 4)
@@ -0,0 +1,41 @@
+import asyncio
+
+
+def _item(sku, slug="bread", title="Хлеб"):
+    return {
+        "sku": sku, "title": f"Товар {sku}", "price_minor": 10000, "available": 1,
+        "sort_order": 0, "category_slug": slug, "category_title": title,
+    }
+
+
+def test_import_hides_only_products_gone_from_feed(app_db):
+    async def scenario():
+        await app_db.init_db()
+        try:
+            await app_db.db_import_products([_item("F-1"), _item("F-2")])
+            general_id = await app_db.db_get_or_create_general_category_id()
+            manual_id = await app_db.db_create_product(general_id, "Торт на заказ", 150000, "MANUAL-1")
+
+            result = await app_db.db_import_products([_item("F-1")])
+            assert result["deactivated"] == 1
+            assert (await app_db.db_find_product_by_sku("F-2"))["available"] == 0
+            assert (await app_db.db_get_product(manual_id))["available"] == 1
+        finally:
+            await app_db.close_db()
+    asyncio.run(scenario())
+
+
+def test_import_adopts_existing_product_with_feed_sku(app_db):
+    async def scenario():
+        await app_db.init_db()
+        try:
+            general_id = await app_db.db_get_or_create_general_category_id()
+            await app_db.db_create_product(general_id, "Багет", 9000, "F-1")
+            await app_db.db_import_products([_item("F-1")])
+            # товар с SKU из выгрузки теперь ведёт импорт и скрывает, когда SKU пропадёт
+            result = await app_db.db_import_products([_item("F-2")])
+            assert result["deactivated"] == 1
+            assert (await app_db.db_find_product_by_sku("F-1"))["available"] == 0
+        finally:
+            await app_db.close_db()
+    asyncio.run(scenario())
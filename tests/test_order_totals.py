@@ -0,0 +1,36 @@
+import asyncio
+
+
+def test_triggers_keep_order_totals_in_sync(app_db):
+    async def scenario():
+        await app_db.init_db()
+        try:
+            await app_db.db_create_or_update_user_base(2001, "Покупатель")
+            user = await app_db.db_get_user_by_tg(2001)
+            order_id = await app_db.db_get_or_create_cart(user["id"])
+
+            async def totals():
+                order = await app_db.db_get_order_basic(order_id)
+                return order["subtotal_minor"], order["delivery_fee_minor"], order["total_minor"]
+
+            await app_db.db_add_item_to_cart(order_id, "A", "Булочка", 5000)
+            await app_db.db_add_item_to_cart(order_id, "A", "Булочка", 5000)
+            await app_db.db_add_item_to_cart(order_id, "B", "Батон", 6500)
+            assert await totals() == (16500, 0, 16500)
+
+            await app_db.db_set_order_delivery_fee(order_id, 15000)
+            assert await totals() == (16500, 15000, 31500)
+
+            async def edit(db):
+                await db.execute("UPDATE order_items SET qty = 5 WHERE order_id = ? AND sku = 'B'", (order_id,))
+                await db.execute("UPDATE order_items SET unit_price_minor = 4000 WHERE order_id = ? AND sku = 'A'",
+                                 (order_id,))
+                await db.execute("DELETE FROM order_items WHERE order_id = ? AND sku = 'B'", (order_id,))
+            await app_db._run_write(edit)
+            assert await totals() == (8000, 15000, 23000)
+
+            await app_db.db_clear_cart(order_id)
+            assert await totals() == (0, 0, 0)
+        finally:
+            await app_db.close_db()
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import pytest
+
+from app import otp
+from app.otp import OTP_EXPIRED, OTP_LOCKED, OTP_MISSING, OTP_OK, OTP_WRONG, OtpStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(otp.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_correct_code_confirms_phone_once(clock):
+    store = OtpStore(ttl=300, max_attempts=3, resend_cooldown=60)
+    store.issue(1, "+79000000001", "1234")
+    assert store.verify(1, "1234") == {"status": OTP_OK, "phone": "+79000000001", "attempts_left": 0}
+    assert store.verify(1, "1234")["status"] == OTP_MISSING
+
+
+def test_wrong_codes_lock_until_expiry(clock):
+    store = OtpStore(ttl=300, max_attempts=2, resend_cooldown=60)
+    store.issue(1, "+79000000001", "1234")
+    assert store.verify(1, "0000") == {"status": OTP_WRONG, "phone": None, "attempts_left": 1}
+    assert store.verify(1, "0000")["status"] == OTP_LOCKED
+    # верный код после блокировки не принимается, и ждать нового — до конца кулдауна
+    assert store.verify(1, "1234")["status"] == OTP_LOCKED
+    assert store.pending_phone(1) is None
+    clock[0] += 301
+    assert store.verify(1, "1234")["status"] == OTP_EXPIRED
+
+
+def test_resend_cooldown_and_pending_phone(clock):
+    store = OtpStore(ttl=300, max_attempts=3, resend_cooldown=60)
+    assert store.cooldown(1) == 0
+    store.issue(1, "+79000000001", "1234")
+    assert store.pending_phone(1) == "+79000000001"
+    clock[0] += 59.5
+    assert store.cooldown(1) == 1
+    clock[0] += 0.5
+    assert store.cooldown(1) == 0
+    # новый код заменяет старый
+    store.issue(1, "+79000000001", "5678")
+    assert store.verify(1, "1234")["status"] == OTP_WRONG
+    assert store.verify(1, "5678")["status"] == OTP_OK
+
+
+def test_oldest_codes_are_evicted_on_overflow(clock):
+    store = OtpStore(ttl=300, max_attempts=3, resend_cooldown=60, max_entries=2)
+    for tg_id in (1, 2, 3):
+        store.issue(tg_id, f"+7900000000{tg_id}", "1111")
+        clock[0] += 1
+    assert store.verify(1, "1111")["status"] == OTP_MISSING
+    assert store.verify(3, "1111")["status"] == OTP_OK
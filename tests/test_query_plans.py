@@ -0,0 +1,6 @@
+from app import check_query_plans
+
+
+def test_no_unexpected_full_scans_or_sorts():
+    # без --verbose печатаются только проблемные запросы — они попадут в вывод pytest
+    assert check_query_plans.main([]) == 0
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from app.send_scheduler import INTERACTIVE, SendScheduler, _Bucket
+
+
+def test_bucket_allows_burst_then_paces_at_rate():
+    bucket = _Bucket(rate=2, burst=3)
+    now = bucket.stamp
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.take()
+    assert bucket.delay(now) == 0.5
+    # через полсекунды накопился ровно один токен
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_bucket_refill_is_capped_by_burst():
+    bucket = _Bucket(rate=10, burst=2)
+    now = bucket.stamp
+    bucket.delay(now + 100)
+    assert bucket.tokens == 2
+
+
+def test_bucket_keeps_reserve_for_interactive_sends():
+    bucket = _Bucket(rate=1, burst=5)
+    now = bucket.stamp
+    for _ in range(3):
+        bucket.take()
+    # осталось 2 токена: обычной отправке хватает, фоновой с запасом 2 — нет
+    assert bucket.delay(now) == 0
+    assert bucket.delay(now, reserve=2) == 1.0
+
+
+def test_bucket_pause_after_retry_after():
+    bucket = _Bucket(rate=1, burst=3)
+    now = bucket.stamp
+    bucket.paused_until = now + 4
+    assert bucket.delay(now + 1) == 3
+    assert bucket.delay(now + 4) == 0
+
+
+def test_acquire_waits_for_chat_token_but_not_for_other_chats():
+    sender = SendScheduler(global_rate=100, chat_rate=10, chat_burst=1)
+
+    async def scenario():
+        await sender._acquire(1, INTERACTIVE)
+        t0 = time.monotonic()
+        await sender._acquire(2, INTERACTIVE)
+        other_chat = time.monotonic() - t0
+        await sender._acquire(1, INTERACTIVE)
+        same_chat = time.monotonic() - t0
+        return other_chat, same_chat
+
+    other_chat, same_chat = asyncio.run(scenario())
+    assert other_chat < 0.05
+    assert same_chat >= 0.09
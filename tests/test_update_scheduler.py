@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.send_scheduler import INTERACTIVE, SendScheduler
+from app.update_scheduler import UpdateScheduler
+
+
+def _update(update_id, user_id):
+    return SimpleNamespace(update_id=update_id), {"event_from_user": SimpleNamespace(id=user_id)}
+
+
+def test_updates_of_one_user_keep_order():
+    scheduler = UpdateScheduler(workers=4)
+    done = []
+
+    async def handler(event, data):
+        # первый апдейт дольше второго — порядок всё равно сохраняется
+        await asyncio.sleep(0.02 if event.update_id == 1 else 0)
+        done.append(event.update_id)
+
+    async def scenario():
+        for n in (1, 2, 3):
+            await scheduler(handler, *_update(n, 7))
+        await scheduler.close()
+
+    asyncio.run(scenario())
+    assert done == [1, 2, 3]
+    assert scheduler.stats()["processed"] == 3
+
+
+def test_chat_send_limit_does_not_hold_the_worker():
+    # один воркер: пока первый пользователь ждёт токена своего чата,
+    # апдейт второго пользователя обрабатывается
+    scheduler = UpdateScheduler(workers=1)
+    sender = SendScheduler(global_rate=100, chat_rate=5, chat_burst=1)
+    done = []
+
+    async def handler(event, data):
+        user_id = data["event_from_user"].id
+        await sender._acquire(user_id, INTERACTIVE)
+        if user_id == 1:
+            await sender._acquire(user_id, INTERACTIVE)
+        done.append(user_id)
+
+    async def scenario():
+        await scheduler(handler, *_update(1, 1))
+        await scheduler(handler, *_update(2, 2))
+        await scheduler.close()
+
+    asyncio.run(scenario())
+    assert done == [2, 1]
+    assert scheduler._slots._value == 1
+
+
+def test_handler_errors_are_counted():
+    scheduler = UpdateScheduler(workers=2)
+
+    async def handler(event, data):
+        raise ValueError("boom")
+
+    async def scenario():
+        await scheduler(handler, *_update(1, 1))
+        await scheduler.close()
+
+    asyncio.run(scenario())
+    assert scheduler.stats()["failed"] == 1
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+_Item = Tuple[Callable[[Update, Dict[str, Any]], Awaitable[Any]], Update, Dict[str, Any]]
+
+
+class _Slot:
+    """Слот воркера, занятый одним апдейтом (см. worker_released)."""
+
+    __slots__ = ("sem", "held", "done")
+
+    def __init__(self, sem: asyncio.Semaphore):
+        self.sem = sem
+        self.held = True
+        self.done = False
+
+
+# слот апдейта, который обрабатывается в текущей задаче
+_slot: ContextVar[Optional[_Slot]] = ContextVar("update_slot", default=None)
+
+
+@asynccontextmanager
+async def worker_released() -> AsyncIterator[None]:
+    """
+    Отдать слот воркера другим пользователям на время ожидания, которое касается
+    только своего чата (лимит отправки в SendScheduler). Апдейты этого пользователя
+    по-прежнему ждут своей очереди; вне планировщика блок ничего не делает.
+    """
+    slot = _slot.get()
+    if slot is None or not slot.held:
+        yield
+        return
+    slot.held = False
+    slot.sem.release()
+    try:
+        yield
+    finally:
+        # апдейт мог завершиться, пока ждала порождённая им задача
+        if not slot.done:
+            await slot.sem.acquire()
+            slot.held = True
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer-middleware уровня Update: у каждого пользователя (или чата) своя
+    очередь апдейтов, которую разбирает одна задача, поэтому апдейты одного
+    пользователя обрабатываются строго по порядку (FSM-сценарии не ломаются),
+    а разные пользователи — параллельно, не более `workers` одновременно.
+    Хендлер, который ждёт лимита отправки в свой чат, слот на это время
+    освобождает. Принятых, но не обработанных апдейтов не больше
+    workers * queue_size: сверх этого приём ждёт освобождения места.
+
+    Подключается через attach(dp): встаёт после FSM-middleware Dispatcher'а,
+    поэтому состояние FSM перечитывается в воркере перед обработкой, а ошибки
+    хендлеров передаются в dp.errors, как без планировщика.
+    """
+
+    def __init__(self, workers: int = 16, queue_size: int = 100):
+        self.workers = max(1, workers)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._capacity = asyncio.Semaphore(self.workers * max(1, queue_size))
+        self._pending: Dict[int, Deque[_Item]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self._errors: Optional[ErrorsMiddleware] = None
+
+    def attach(self, dp: Dispatcher):
+        """Поставить планировщик перед обработкой апдейтов dp."""
+        self._errors = ErrorsMiddleware(dp)
+        dp.update.outer_middleware(self)
+        dp["update_scheduler"] = self
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        key = user.id if user else (chat.id if chat else 0)
+        await self._capacity.acquire()
+        pending = self._pending.get(key)
+        if pending is not None:
+            # очередь пользователя уже разбирается — апдейт будет взят следом
+            pending.append((handler, event, data))
+            return None
+        self._pending[key] = deque([(handler, event, data)])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return None
+
+    async def _drain(self, key: int):
+        pending = self._pending[key]
+        try:
+            while pending:
+                item = pending.popleft()
+                try:
+                    await self._process(*item)
+                finally:
+                    self._capacity.release()
+        finally:
+            del self._pending[key]
+
+    async def _process(
+        self, handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]], event: Update, data: Dict[str, Any]
+    ):
+        await self._slots.acquire()
+        slot = _Slot(self._slots)
+        token = _slot.set(slot)
+        self.busy += 1
+        try:
+            state = data.get("state")
+            if state is not None:
+                # raw_state прочитан при постановке в очередь; предыдущий апдейт
+                # этого пользователя мог сменить состояние, пока этот ждал
+                data["raw_state"] = await state.get_state()
+            if self._errors is not None:
+                await self._errors(handler, event, data)
+            else:
+                await handler(event, data)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logger.exception("Ошибка обработки апдейта %s", event.update_id)
+        finally:
+            self.busy -= 1
+            _slot.reset(token)
+            slot.done = True
+            if slot.held:
+                self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей и счётчики — для мониторинга."""
+        depths = [len(p) for p in self._pending.values()]
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def close(self, timeout: Optional[float] = 10.0):
+        """Дождаться разбора очередей (не дольше timeout) и остановить обработку."""
+        if self._tasks:
+            _, left = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if left:
+                logger.warning("Остановка: в очередях остались необработанные апдейты")
+                for task in left:
+                    task.cancel()
+                await asyncio.gather(*left, return_exceptions=True)
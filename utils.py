@@ -21,6 +21,16 @@ def format_address(addr: Dict[str, Any]) -> str:
     if addr.get("comment"): parts.append(f"коммент: {addr['comment']}")
     return ", ".join([p for p in parts if p])
 
+async def make_unique_sku(title: str) -> str:
+    """SKU из названия товара: «Булочка с маком» -> "булочка-с-маком", при занятом — с суффиксом -2, -3, ..."""
+    from app.db import db_find_product_by_sku  # app.db сам импортирует utils
+    base = re.sub(r"\W+", "-", (title or "").lower()).strip("-_")[:40] or "item"
+    sku, n = base, 1
+    while await db_find_product_by_sku(sku):
+        n += 1
+        sku = f"{base}-{n}"
+    return sku
+
 def make_otp_code(length: int = OTP_CODE_LENGTH) -> str:
     import random
     length = min(max(length, 4), 8)  # 4..8
@@ -0,0 +1,85 @@
+import asyncio
+import hmac
+import logging
+import secrets
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+
+from app.config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookReceiver:
+    """
+    Приём апдейтов по HTTP: проверяет секрет и передаёт апдейт в Dispatcher.
+    Dispatcher должен быть собран с UpdateScheduler: он только ставит апдейт
+    в ограниченную очередь, поэтому ответ 200 уходит сразу, а при полной
+    очереди задерживается — и Telegram сам притормаживает доставку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str):
+        if not secret:
+            raise ValueError("webhook secret is required")
+        if dp.get("update_scheduler") is None:
+            raise ValueError("Dispatcher must be built with UpdateScheduler")
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+        if not isinstance(update, dict):
+            # валидный JSON, но не объект апдейта (например, [1])
+            return web.Response(status=400, text="Bad Request")
+        try:
+            # ждёт только места в очереди планировщика, не обработки
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            # 200 всё равно: иначе Telegram будет повторять тот же апдейт
+            logger.exception("Ошибка приёма апдейта %s", update.get("update_id"))
+        return web.Response(status=200)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Поднимает aiohttp-сервер на WEBHOOK_HOST:WEBHOOK_PORT и регистрирует
+    вебхук в Telegram, если задан WEBHOOK_URL. Без WEBHOOK_URL сервер
+    работает только локально — удобно для проверки: POST JSON апдейта на
+    http://WEBHOOK_HOST:WEBHOOK_PORT{WEBHOOK_PATH} с заголовком секрета.
+    Без WEBHOOK_SECRET генерируется случайный секрет на время работы.
+    """
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET не задан: используется случайный секрет до перезапуска")
+    receiver = WebhookReceiver(dp, bot, secret)
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receiver.handle)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+    print(f"Webhook server on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()